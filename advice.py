@@ -1,41 +1,74 @@
-import json
 import os
-from datetime import datetime
-from openai import OpenAI
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def get_philosophical_advice(note_dir, identity="a wise philosopher"):
-    # 1. Open and read weekly_summaries.json
-    note_dir = os.path.expanduser(note_dir)
-    json_path = os.path.join(note_dir, 'weekly_summaries.json')
-    try:
-        with open(json_path, 'r') as f:
-            weekly_data = json.load(f)
-    except FileNotFoundError:
-        return "Error: Could not find weekly_summaries.json"
-
-    # 2. Find the latest week
-    if not weekly_data:
-        return "Error: No weekly summaries found"
-    
-    # Convert list of entries to dictionary keyed by week
-    weekly_dict = {entry['week']: entry['summary']['overall_summary'] 
-                   for entry in weekly_data 
+import llm_cache
+import profiling
+import search
+from storage import get_store
+
+# How many philosophers are asked at once by stream_philosophical_advice
+ADVICE_CONCURRENCY = int(os.environ.get('LIFEOS_ADVICE_CONCURRENCY', 4))
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    # One OpenAI client per process, so its connection pool is reused across calls
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # Imported here: the SDK takes most of a second to load
+                from openai import OpenAI
+                _client = OpenAI()
+    return _client
+
+def load_latest_summary(note_dir):
+    # Returns (the latest week's overall summary, None), or (None, error message)
+    store = get_store(note_dir)
+    if not store.summaries_exist():
+        return None, "Error: Could not find weekly summaries"
+
+    # Weeks are ISO dates, so the newest one is also the largest string
+    latest = store.latest_summary()
+    if latest and 'overall_summary' in latest.get('summary', {}):
+        return latest['summary']['overall_summary'], None
+
+    weekly_dict = {entry['week']: entry['summary']['overall_summary']
+                   for entry in store.load_summaries()
                    if 'week' in entry and 'summary' in entry and 'overall_summary' in entry['summary']}
-    
     if not weekly_dict:
-        return "Error: No valid weekly summaries found"
-    
-    latest_week = max(weekly_dict.keys(), key=lambda x: datetime.strptime(x, '%Y-%m-%d'))
-    latest_summary = weekly_dict[latest_week]
+        return None, "Error: No valid weekly summaries found"
+    return weekly_dict[max(weekly_dict)], None
+
+def get_philosophical_advice(note_dir, identity="a wise philosopher", use_cache=True, latest_summary=None,
+                             retrieved_context=None):
+    # 1. Find the latest week's summary, unless the caller already has it
+    if latest_summary is None:
+        latest_summary, error = load_latest_summary(note_dir)
+        if error:
+            return error
 
-    # 3. Generate philosophical advice using OpenAI
-    client = OpenAI()
+    # Earlier summaries and notes that relate to this week, from the search index
+    if retrieved_context is None:
+        retrieved_context = search.retrieve_context(note_dir, latest_summary)
+
+    # 2. Generate philosophical advice using OpenAI
+    client = get_client()
     
     prompt = f"""Given this person's weekly summary: "{latest_summary}", 
     provide structured advice as if you were {identity}. Focus on practical wisdom and ethical living."""
+    if retrieved_context:
+        prompt += f"""
+
+    Related excerpts from their earlier summaries and notes:
+{retrieved_context}"""
 
     try:
-        response = client.chat.completions.create(
+        response = llm_cache.chat_completion(
+            client,
+            use_cache=use_cache,
             model="gpt-4",
             messages=[
                 {"role": "system", "content": f"You are {identity}. Provide advice in a structured format."},
@@ -80,10 +113,35 @@ Only include the quote and citation - no need for an explanation."""
             function_call={"name": "provide_structured_advice"}
         )
         
-        # 4. Return the structured advice
-        return response.choices[0].message.function_call.arguments
+        # 3. Return the structured advice
+        return response['choices'][0]['message']['function_call']['arguments']
     except Exception as e:
         return f"Error generating advice: {str(e)}"
 
-# Example usage:
-print(get_philosophical_advice('~/notes', "Steve Jobs"))
+def stream_philosophical_advice(note_dir, philosophers, max_workers=None, use_cache=True):
+    # Asks every philosopher concurrently against the same latest summary and
+    # yields (philosopher, advice) as each one finishes
+    latest_summary, error = load_latest_summary(note_dir)
+    if error:
+        for philosopher in philosophers:
+            yield philosopher, error
+        return
+
+    # Retrieved once and shared, like the summary
+    retrieved_context = search.retrieve_context(note_dir, latest_summary)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers or ADVICE_CONCURRENCY, len(philosophers))))
+    try:
+        futures = {
+            executor.submit(profiling.wrap(get_philosophical_advice), note_dir, philosopher, use_cache, latest_summary,
+                            retrieved_context): philosopher
+            for philosopher in philosophers
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+if __name__ == "__main__":
+    # Example usage:
+    print(get_philosophical_advice('~/notes', "Steve Jobs"))
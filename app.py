@@ -1,42 +1,307 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, send_file
 from flask_cors import CORS
+import bisect
+import hashlib
 import json
+import mimetypes
 import os
+import threading
+import time
+from datetime import datetime, timezone
+from werkzeug.http import is_resource_modified
 
-import requests
-from advice import get_philosophical_advice
+import advice
+import http_client
+import jobs
+import llm_cache
+import locks
+import metrics
+import profiling
+import search
 import summarize
+import tokens
+import trends
+import watcher
+from storage import atomic_write, atomic_write_chunks, get_store
+from lazy_imports import lazy_import
+from response_cache import cache as response_cache
+
+# Only used for its exception types; loaded on first use
+requests = lazy_import('requests')
 
 app = Flask(__name__)
-CORS(app)  # This will enable CORS for all routes
+# This will enable CORS for all routes. Browsers hide response headers from
+# cross-origin pages unless they're exposed, and the visualizer and editors
+# need the paging cursor, ETags for If-Match, and Retry-After.
+CORS(app, expose_headers=['X-Next-Cursor', 'ETag', 'Last-Modified', 'Retry-After', 'X-Profile-Path'])
+
+def profile_requested():
+    return request.headers.get('X-Profile') in ('1', 'true') or request.args.get('profile') in ('1', 'true')
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profiler = None
+    # Requests sent with `X-Profile: 1` or ?profile=1 are profiled, along
+    # with the work they hand to thread pools; see profiling.py
+    if profile_requested():
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        profile = profiling.Profile(route.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'root')
+        if profile.start():
+            g.profiler = profile
+
+@app.after_request
+def record_request(response):
+    # Finished when the response is closed, so streamed bodies are included
+    start = g.get('request_start')
+    profiler = g.get('profiler')
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    method = request.method
+    if profiler is not None:
+        response.headers['X-Profile-Path'] = profiler.path
+        # Handed over to finish(); see discard_unfinished_profile
+        g.profiler = None
+
+    def finish():
+        if start is not None:
+            metrics.http_requests.observe(time.perf_counter() - start, route=route, method=method,
+                                          status=response.status_code)
+        if profiler is not None:
+            profiler.finish()
+
+    response.call_on_close(finish)
+    return response
+
+@app.teardown_request
+def discard_unfinished_profile(exc):
+    # A request that raised never reached record_request; free the profiler
+    profiler = g.get('profiler')
+    if profiler is not None:
+        profiler.discard()
+        g.profiler = None
+
+@app.errorhandler(http_client.UpstreamBusy)
+def upstream_busy(e):
+    # Every connection to the upstream is in use (open /chat streams, say)
+    response = jsonify({"error": str(e)})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Importing this module does no I/O and loads no heavy client libraries.
+# Once the server is up, warm-up loads them (and opens the local databases)
+# in the background so the first real request doesn't pay for it; /ready
+# answers 503 until it's done.
+WARM_UP_STEPS = [
+    # The client itself can only be built once there's an API key
+    ('openai', lambda: (summarize.openai._lazy_load(), os.environ.get('OPENAI_API_KEY') and advice.get_client())),
+    ('requests', lambda: [upstream.session for upstream in http_client.upstreams.values()]),
+    ('numpy', lambda: search.np._lazy_load()),
+    ('tokenizer', lambda: tokens.count_tokens('warm up')),
+    ('llm_cache', lambda: llm_cache.cache._connection()),
+    # Also marks jobs left running by a dead process as interrupted
+    ('jobs', lambda: jobs.queue._connection()),
+]
+warm_up_state = {'started': None, 'finished': None, 'steps': {}, 'errors': {}}
+_warm_up_lock = threading.Lock()
+
+def warm_up():
+    for name, step in WARM_UP_STEPS:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            # A missing API key or an offline tokenizer shouldn't keep the server unready
+            print(f'Warm-up step {name} failed: {str(e)}')
+            warm_up_state['errors'][name] = str(e)
+        warm_up_state['steps'][name] = time.perf_counter() - start
+    warm_up_state['finished'] = time.time()
+
+def start_warm_up():
+    # Idempotent; called from the gunicorn worker hook, `python app.py`, or the first request
+    with _warm_up_lock:
+        if warm_up_state['started'] is None:
+            warm_up_state['started'] = time.time()
+            threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+@app.before_request
+def warm_up_on_first_request():
+    if warm_up_state['started'] is None:
+        start_warm_up()
+
+@app.route('/ready')
+def ready():
+    state = {
+        'ready': warm_up_state['finished'] is not None,
+        'steps': dict(warm_up_state['steps']),
+        'errors': dict(warm_up_state['errors']),
+        'pending': [name for name, _ in WARM_UP_STEPS if name not in warm_up_state['steps']],
+    }
+    return jsonify(state), 200 if state['ready'] else 503
+
+# Set LIFEOS_WATCH=1 to keep each notes directory indexed in memory by a
+# filesystem watcher instead of rescanning it on every poll
+WATCH_NOTES = os.environ.get('LIFEOS_WATCH') == '1'
+
+def note_watcher(directory):
+    if not WATCH_NOTES:
+        return None
+    try:
+        return watcher.watch(directory)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # Fall back to scanning; the next request tries to start it again
+        print(f'Error starting the watcher for {directory}: {str(e)}')
+        return None
+
+def use_llm_cache(data=None):
+    # Completions are cached unless the client sends `Cache-Control: no-cache`,
+    # ?cache=0, or "cache": false in a JSON body
+    if 'no-cache' in request.headers.get('Cache-Control', ''):
+        return False
+    if request.args.get('cache') in ('0', 'false'):
+        return False
+    return not (data and data.get('cache') is False)
+
+def cached_json_response(store, kind):
+    # Serves a stored document from the response cache, answering conditional GETs with 304
+    entry = response_cache.get_document(store, kind)
+    response = Response(entry.body, mimetype='application/json')
+    response.set_etag(entry.etag)
+    response.last_modified = entry.last_modified
+    return response.make_conditional(request)
+
+def week_timestamp(week):
+    # Same key summarize.py stores on each entry
+    return datetime.strptime(week, "%Y-%m-%d").timestamp()
+
+def project_summary(entry, fields):
+    projected = {'week': entry['week'], 'timestamp': entry['timestamp']}
+    projected['summary'] = {field: entry['summary'][field] for field in fields if field in entry['summary']}
+    if 'files' in fields and 'files' in entry:
+        projected['files'] = entry['files']
+    return projected
 
 @app.route("/weekly_summaries")
 def weekly_summaries():
     # Get the directory from query parameters
     directory = request.args.get('directory', '~/notes')  # Default to '~/notes' if not provided
-    # Construct the path to weekly_summaries.json
-    json_file_path = os.path.join(os.path.expanduser(directory), 'weekly_summaries.json')
-    # Read and return the contents of the JSON file
-    with open(json_file_path, 'r') as file:
-        weekly_summaries = json.load(file)
-    return json.dumps(weekly_summaries, indent=4)
+    store = get_store(directory)
+    # With LIFEOS_WATCH=1 the watcher re-serializes the summaries as soon as
+    # they change, so this is answered straight from the response cache
+    note_watcher(directory)
+    # Optional filters: `from`/`to` week keys (inclusive), `fields` to project the
+    # summary, `cursor` (timestamp of the last entry seen) with `limit` to page,
+    # and format=ndjson to stream one entry per line
+    week_from = request.args.get('from')
+    week_to = request.args.get('to')
+    fields = [field for field in request.args.get('fields', '').split(',') if field]
+    cursor = request.args.get('cursor', None, type=float)
+    limit = request.args.get('limit', None, type=int)
+    ndjson = request.args.get('format') == 'ndjson'
+
+    try:
+        if not (week_from or week_to or fields or cursor is not None or limit or ndjson):
+            return cached_json_response(store, 'summaries')
+        entry = response_cache.get_document(store, 'summaries')
+    except FileNotFoundError:
+        return jsonify({"error": "No weekly summaries found"}), 404
+
+    try:
+        start_timestamp = week_timestamp(week_from) if week_from else None
+        end_timestamp = week_timestamp(week_to) if week_to else None
+    except ValueError:
+        return jsonify({"error": "from and to must be weeks formatted as YYYY-MM-DD"}), 400
+
+    # Entries are sorted by timestamp, so every bound is a bisect
+    entries, timestamps = entry.timestamp_index()
+    start = 0
+    if start_timestamp is not None:
+        start = bisect.bisect_left(timestamps, start_timestamp)
+    if cursor is not None:
+        start = max(start, bisect.bisect_right(timestamps, cursor))
+    end = len(entries)
+    if end_timestamp is not None:
+        end = bisect.bisect_right(timestamps, end_timestamp)
+    next_cursor = None
+    if limit and limit > 0 and start + limit < end:
+        end = start + limit
+        next_cursor = timestamps[end - 1]
+
+    def page():
+        for i in range(start, end):
+            yield project_summary(entries[i], fields) if fields else entries[i]
+
+    if ndjson:
+        response = Response((json.dumps(item) + '\n' for item in page()), mimetype='application/x-ndjson')
+    else:
+        response = Response(json.dumps(list(page()), separators=(',', ':')), mimetype='application/json')
+        response.set_etag(f'{entry.etag}-{hashlib.blake2b(request.query_string, digest_size=8).hexdigest()}')
+        response.last_modified = entry.last_modified
+        response = response.make_conditional(request)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = repr(next_cursor)
+    return response
 
 @app.route('/summarize', methods=['POST'])
 @app.route('/summarize/<path:directory>', methods=['POST'])
-def summarize_notes():
-    directory = request.args.get('directory', '~/notes')  # Default to '~/notes' if not provided
-    summarize.summarize_new_notes(directory)
-    return "Summarization complete", 200
+def summarize_notes(directory=None):
+    directory = directory or request.args.get('directory', '~/notes')  # Default to '~/notes' if not provided
+    # Optional pipelined mode: number of weeks summarized in parallel, and a cap on GPT calls per minute
+    concurrency = request.args.get('concurrency', 1, type=int)
+    requests_per_minute = request.args.get('requests_per_minute', None, type=float)
+    params = {'concurrency': concurrency, 'requests_per_minute': requests_per_minute, 'use_cache': use_llm_cache()}
+
+    # ?wait=1 keeps the old behaviour of summarizing inside the request
+    if request.args.get('wait') in ('1', 'true'):
+        try:
+            summarize.summarize_new_notes(directory, **params)
+        except locks.LockTimeout as e:
+            # Another worker (or a CLI run) is summarizing this directory
+            return jsonify({"error": str(e)}), 409
+        return "Summarization complete", 200
+
+    # Otherwise the run is queued (or joins the one already running for this
+    # directory) and the client polls GET /jobs/<id>. With ?profile=1 the job
+    # itself is profiled too, and reports where in profile_path.
+    job, created = jobs.queue.submit(directory, profile=profile_requested(), **params)
+    response = jsonify(job)
+    response.status_code = 202
+    response.headers['Location'] = f'/jobs/{job["id"]}'
+    return response
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "No such job"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = jobs.queue.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "No such job"}), 404
+    return jsonify(job)
 
 
 
 @app.route('/unsummarized_count')
 def unsummarized_count():
     directory = request.args.get('directory', '~/notes')  # Default to '~/notes' if not provided
-    expanded_dir = os.path.expanduser(directory)
-    json_file_path = os.path.join(expanded_dir, 'weekly_summaries.json')
-    
-    unsummarized_weeks = summarize.get_unsummarized_weeks(directory, json_file_path)
+    active_watcher = note_watcher(directory)
+    if active_watcher:
+        return jsonify({
+            'unsummarized_count': active_watcher.unsummarized_count,
+            'unsummarized_weeks': len(active_watcher.unsummarized_weeks)
+        })
+
+    unsummarized_weeks = summarize.get_unsummarized_weeks(directory)
     
     total_unsummarized_notes = sum(len(files) for files in unsummarized_weeks.values())
     
@@ -71,7 +336,7 @@ def get_links():
             "use_autoprompt": True
         }
         
-        response = requests.post("https://api.exa.ai/search", headers=headers, json=payload)
+        response = http_client.exa.post("/search", headers=headers, json=payload)
         response.raise_for_status()
         
         # Extract relevant links from the response
@@ -83,6 +348,15 @@ def get_links():
     except requests.RequestException as e:
         return jsonify({"error": f"Error fetching links: {str(e)}"}), 500
 
+def with_retrieved_context(directory, messages, token_budget=None):
+    query = next((m.get('content') for m in reversed(messages)
+                  if m.get('role') == 'user' and isinstance(m.get('content'), str)), None)
+    context = search.retrieve_context(directory, query, token_budget)
+    if not context:
+        return messages
+    return [{"role": "system",
+             "content": f"Relevant excerpts from the user's weekly summaries and notes:\n\n{context}"}] + messages
+
 @app.route('/chat', methods=['POST'])
 def chat():
     # Get OpenAI API key from environment variables
@@ -97,6 +371,13 @@ def chat():
     if not messages:
         return jsonify({"error": "No messages provided"}), 400
 
+    context_tokens = data.get('context_tokens')
+    if context_tokens is not None:
+        try:
+            context_tokens = int(context_tokens)
+        except (TypeError, ValueError, OverflowError):
+            return jsonify({"error": "context_tokens must be an integer"}), 400
+
     try:
         # Make request to OpenAI API
         headers = {
@@ -104,24 +385,127 @@ def chat():
             "Authorization": f"Bearer {openai_api_key}"
         }
         
+        # With a notes directory, send the excerpts most relevant to the last
+        # user message instead of relying on the client to paste its history
+        directory = data.get('directory')
+        if directory:
+            messages = with_retrieved_context(directory, messages, context_tokens)
+
         payload = {
             "model": "gpt-4",  # or "gpt-4" depending on your needs
             "messages": messages
         }
+
+        # "stream": true relays tokens as server-sent events as they're generated
+        if data.get('stream'):
+            return stream_chat(payload, headers, use_llm_cache(data))
         
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=payload
-        )
-        response.raise_for_status()
+        def call(payload):
+            response = http_client.openai.post(
+                "/chat/completions",
+                headers=headers,
+                json=payload
+            )
+            response.raise_for_status()
+            return response.json()
         
         # Return the response from OpenAI
-        return jsonify(response.json())
+        return jsonify(llm_cache.cached_call(payload, call, use_cache=use_llm_cache(data)))
     
     except requests.RequestException as e:
         return jsonify({"error": f"Error calling OpenAI API: {str(e)}"}), 500
 
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def sse_event(data):
+    return f'data: {data}\n\n'
+
+def stream_chat(payload, headers, use_cache):
+    key = llm_cache.cache_key(payload)
+    cached = llm_cache.cache.get(key) if use_cache else None
+    if cached is not None:
+        # Replay a cached completion as a single chunk in the streaming format
+        def replay():
+            message = cached['choices'][0]['message']
+            yield sse_event(json.dumps({'choices': [{'index': 0, 'delta': message, 'finish_reason': 'stop'}]}))
+            yield sse_event('[DONE]')
+        return Response(replay(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+    upstream = http_client.openai.post(
+        "/chat/completions",
+        headers=headers,
+        json={**payload, "stream": True},
+        stream=True
+    )
+    # The streamed response holds one of the upstream's concurrency slots until closed
+    try:
+        upstream.raise_for_status()
+    except requests.RequestException:
+        upstream.close()
+        raise
+
+    def relay():
+        content = []
+        finish_reason = None
+        try:
+            for line in upstream.iter_lines(chunk_size=None, decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                chunk = line[len('data:'):].strip()
+                yield sse_event(chunk)
+                if chunk == '[DONE]':
+                    break
+                choice = json.loads(chunk)['choices'][0]
+                content.append(choice.get('delta', {}).get('content') or '')
+                finish_reason = choice.get('finish_reason') or finish_reason
+            else:
+                return
+        except requests.RequestException as e:
+            yield f'event: error\n{sse_event(json.dumps({"error": f"Error calling OpenAI API: {str(e)}"}))}'
+            return
+        finally:
+            # Runs on client disconnect too (the server closes this generator),
+            # dropping the upstream connection so OpenAI stops generating
+            upstream.close()
+        # Only completions that ran to [DONE] are cached
+        llm_cache.cache.put(key, {'choices': [{'index': 0, 'finish_reason': finish_reason,
+                                               'message': {'role': 'assistant', 'content': ''.join(content)}}]})
+
+    response = Response(relay(), mimetype='text/event-stream', headers=SSE_HEADERS)
+    # relay()'s finally doesn't run if the client goes away before the first chunk
+    response.call_on_close(upstream.close)
+    return response
+
+def file_etag(st):
+    # Changes whenever the file is modified or replaced (atomic writes give it a new inode)
+    return f'{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}'
+
+def apply_patches(text, patches):
+    # Each patch deletes `delete` characters at `offset` and inserts `insert`
+    # there, applied in order against the result of the previous one
+    for patch in patches:
+        offset = patch.get('offset')
+        delete = patch.get('delete', 0)
+        insert = patch.get('insert', '')
+        if not isinstance(offset, int) or not isinstance(delete, int) or not isinstance(insert, str):
+            raise ValueError("Each patch needs an integer offset, an integer delete and a string insert")
+        if offset < 0 or delete < 0 or offset + delete > len(text):
+            raise ValueError(f"Patch at {offset} deleting {delete} is outside the {len(text)} character file")
+        text = text[:offset] + insert + text[offset + delete:]
+    return text
+
+def append_chunks(file_path, chunks):
+    # Appends in place rather than rewriting: existing content is never at
+    # risk, and at worst a crash leaves part of the new tail
+    size = 0
+    with open(file_path, 'ab') as file:
+        for chunk in chunks:
+            file.write(chunk)
+            size += len(chunk)
+        file.flush()
+        os.fsync(file.fileno())
+    metrics.file_io_bytes.inc(size, op='write', kind='notes')
+
 @app.route('/read_file', methods=['GET'])
 def read_file():
     # Get the file path from query parameters
@@ -133,9 +517,33 @@ def read_file():
     file_path = os.path.expanduser(file_path)
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
-        return jsonify({"content": content})
+        st = os.stat(file_path)
+        etag = file_etag(st)
+
+        # ?raw=1, or any Range request, streams the file itself (206 for
+        # ranges); otherwise the original {"content": ...} JSON is returned.
+        # Both answer If-None-Match / If-Modified-Since with 304.
+        if request.args.get('raw') in ('1', 'true') or request.range is not None:
+            response = send_file(file_path, mimetype=mimetypes.guess_type(file_path)[0] or 'text/plain',
+                                 conditional=True, etag=etag, last_modified=st.st_mtime, max_age=0)
+            if response.status_code != 304:
+                metrics.file_io_bytes.inc(response.content_length or 0, op='read', kind='notes')
+            return response
+
+        json_etag = f'{etag}.json'
+        last_modified = datetime.fromtimestamp(st.st_mtime, timezone.utc)
+        if not is_resource_modified(request.environ, etag=json_etag, last_modified=last_modified):
+            response = Response(status=304)
+        else:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                content = file.read()
+            metrics.file_io_bytes.inc(st.st_size, op='read', kind='notes')
+            # The etag is in the body too, as /write_file returns it, for clients
+            # that can't read response headers; send it back in If-Match
+            response = jsonify({"content": content, "etag": etag})
+        response.set_etag(json_etag)
+        response.last_modified = last_modified
+        return response
     except FileNotFoundError:
         return jsonify({"error": f"File not found: {file_path}"}), 404
     except Exception as e:
@@ -143,23 +551,71 @@ def read_file():
 
 @app.route('/write_file', methods=['POST'])
 def write_file():
-    data = request.json
-    file_path = data.get('path')
-    content = data.get('content')
+    # JSON bodies: {"path", "content"} replaces the file, {"path", "append"}
+    # adds to its end, and {"path", "patches": [{"offset", "delete", "insert"}]}
+    # edits it, with offsets in characters of the text /read_file returns.
+    # Any other body is streamed to ?path= as the new contents (?append=1 to
+    # append instead). Replacements are atomic. Send If-Match with an ETag
+    # from /read_file to refuse the write if the file changed since. Writes to
+    # one file are serialized across workers, so a check against If-Match, or
+    # a patch against the text it read, can't race another write.
+    if request.is_json:
+        data = request.json
+        file_path = data.get('path')
+    else:
+        data = None
+        file_path = request.args.get('path')
 
-    if not file_path or content is None:
+    if not file_path:
+        return jsonify({"error": "No file path provided"}), 400
+    if data is not None and data.get('content') is None and data.get('append') is None and data.get('patches') is None:
         return jsonify({"error": "Both file path and content are required"}), 400
 
     # Expand user path if necessary
     file_path = os.path.expanduser(file_path)
 
     try:
-        # Create directories if they don't exist
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        
-        with open(file_path, 'w', encoding='utf-8') as file:
-            file.write(content)
-        return jsonify({"message": f"Successfully wrote to {file_path}"})
+        with locks.get_lock(file_path, 'file').write():
+            if request.if_match:
+                try:
+                    current = file_etag(os.stat(file_path))
+                except FileNotFoundError:
+                    current = None
+                if current is None or not (request.if_match.star_tag or current in request.if_match
+                                           or f'{current}.json' in request.if_match):
+                    return jsonify({"error": f"{file_path} changed since it was read"}), 412
+
+            # Create directories if they don't exist
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+            if data is None:
+                chunks = iter(lambda: request.stream.read(64 * 1024), b'')
+                if request.args.get('append') in ('1', 'true'):
+                    append_chunks(file_path, chunks)
+                else:
+                    atomic_write_chunks(file_path, chunks, kind='notes')
+            elif data.get('patches') is not None:
+                with open(file_path, 'r', encoding='utf-8') as file:
+                    content = file.read()
+                    metrics.file_io_bytes.inc(os.fstat(file.fileno()).st_size, op='read', kind='notes')
+                atomic_write(file_path, apply_patches(content, data['patches']).encode('utf-8'), kind='notes')
+            elif data.get('content') is not None:
+                atomic_write(file_path, data['content'].encode('utf-8'), kind='notes')
+            else:
+                append_chunks(file_path, [data['append'].encode('utf-8')])
+
+            st = os.stat(file_path)
+        response = jsonify({"message": f"Successfully wrote to {file_path}", "etag": file_etag(st), "size": st.st_size})
+        response.set_etag(file_etag(st))
+        return response
+    except FileNotFoundError:
+        return jsonify({"error": f"File not found: {file_path}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except locks.LockTimeout as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = '1'
+        return response, 503
     except Exception as e:
         return jsonify({"error": f"Error writing file: {str(e)}"}), 500
 
@@ -168,21 +624,42 @@ def generate_advice():
     data = request.json
     philosophers = data.get('philosophers', [])
     directory = os.path.expanduser(data.get('directory', '~/notes'))
+    # How many philosophers to ask at once, and whether to stream each one's
+    # advice as an NDJSON line as soon as it arrives
+    concurrency = data.get('concurrency')
+    stream = data.get('stream', False) or request.args.get('format') == 'ndjson'
 
     if not philosophers:
         return jsonify({"error": "No philosophers provided"}), 400
 
+    results = advice.stream_philosophical_advice(directory, philosophers, concurrency, use_cache=use_llm_cache(data))
+
+    if stream:
+        def generate():
+            advice_by_philosopher = {}
+            for philosopher, raw_advice in results:
+                try:
+                    item = json.loads(raw_advice)
+                except ValueError:
+                    item = {"error": raw_advice}
+                else:
+                    advice_by_philosopher[philosopher] = item
+                item['philosopher'] = philosopher
+                yield json.dumps(item) + '\n'
+            # Save what succeeded, in the order it was asked for
+            get_store(directory).save_advice([advice_by_philosopher[p] for p in philosophers if p in advice_by_philosopher])
+        return Response(generate(), mimetype='application/x-ndjson')
+
     try:
-        advice_list = []
-        for philosopher in philosophers:
-            advice = json.loads(get_philosophical_advice(directory, philosopher))
-            advice['philosopher'] = philosopher
-            advice_list.append(advice)
+        advice_by_philosopher = {}
+        for philosopher, raw_advice in results:
+            item = json.loads(raw_advice)
+            item['philosopher'] = philosopher
+            advice_by_philosopher[philosopher] = item
+        advice_list = [advice_by_philosopher[philosopher] for philosopher in philosophers]
 
-        # Write to advice.json in the specified directory
-        advice_path = os.path.join(directory, 'advice.json')
-        with open(advice_path, 'w') as f:
-            json.dump(advice_list, f, indent=4)
+        # Save alongside the summaries in the specified directory
+        get_store(directory).save_advice(advice_list)
 
         return jsonify(advice_list)
     except Exception as e:
@@ -191,17 +668,76 @@ def generate_advice():
 @app.route('/get_advice', methods=['GET'])
 def get_saved_advice():
     directory = os.path.expanduser(request.args.get('directory', '~/notes'))
-    advice_path = os.path.join(directory, 'advice.json')
     
     try:
-        with open(advice_path, 'r') as f:
-            advice_list = json.load(f)
-        return jsonify(advice_list)
+        return cached_json_response(get_store(directory), 'advice')
     except FileNotFoundError:
         return jsonify({"error": "No advice file found"}), 404
     except Exception as e:
         return jsonify({"error": f"Error reading advice file: {str(e)}"}), 500
 
+@app.route('/search', methods=['GET'])
+def search_notes():
+    directory = request.args.get('directory', '~/notes')  # Default to '~/notes' if not provided
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "No query provided"}), 400
+    try:
+        k = max(1, min(int(request.args.get('k', 10)), 100))
+    except ValueError:
+        return jsonify({"error": "k must be an integer"}), 400
+    kind = request.args.get('kind')
+    if kind not in (None, 'summary', 'note'):
+        return jsonify({"error": "kind must be summary or note"}), 400
+
+    index = search.get_index(directory)
+    if not index.exists():
+        return jsonify({"error": "No search index found; run python search.py <directory> to build it"}), 404
+    try:
+        results = index.search(query, k, kinds=[kind] if kind else None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        return jsonify({"error": f"Error searching notes: {str(e)}"}), 500
+    return jsonify({"results": results})
+
+@app.route('/trends', methods=['GET'])
+def phrase_trends():
+    # How often words or two-word phrases came up over time. q takes several,
+    # comma-separated (or repeated); from/to bound the weeks (YYYY-MM-DD,
+    # inclusive); granularity is week, month or year; source is summary,
+    # notes or all. Answered from the counts kept in .lifeos/trends.
+    directory = request.args.get('directory', '~/notes')  # Default to '~/notes' if not provided
+    phrases = [phrase.strip() for q in request.args.getlist('q') for phrase in q.split(',') if phrase.strip()]
+    if not phrases:
+        return jsonify({"error": "No query provided"}), 400
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in trends.GRANULARITIES:
+        return jsonify({"error": "granularity must be week, month or year"}), 400
+    source = request.args.get('source', 'all')
+    if source not in ('summary', 'notes', 'all'):
+        return jsonify({"error": "source must be summary, notes or all"}), 400
+    week_from = request.args.get('from')
+    week_to = request.args.get('to')
+    for week in (week_from, week_to):
+        if week and not trends.is_date(week):
+            return jsonify({"error": "from and to must be dates formatted as YYYY-MM-DD"}), 400
+
+    index = trends.get_index(directory)
+    if not index.exists():
+        return jsonify({"error": "No trends index found; run python trends.py <directory> to build it"}), 404
+    try:
+        result = index.trends(phrases, week_from, week_to, granularity,
+                              trends.SOURCES if source == 'all' else (source,))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error computing trends: {str(e)}"}), 500
+    return jsonify({"granularity": granularity, "source": source, **result})
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    # With the reloader, only the child process that serves requests warms up
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warm_up()
+    app.run(debug=True, threaded=True)
 
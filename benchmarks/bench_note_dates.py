@@ -0,0 +1,81 @@
+# Compares note_dates.week_key_for_filename with the strptime-based parser it
+# replaced, on synthetic filenames: checks they agree on every legacy-format
+# name and times both, cold and with the memoization cache warm.
+#
+#   python benchmarks/bench_note_dates.py [count]
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import note_dates
+
+
+def strptime_week_key(filename):
+    # The original parser, kept here as the reference
+    basename = filename.split('.')[0]
+    for date_format in ("%a %b %d %Y", "%b %d %Y"):
+        try:
+            file_date = datetime.strptime(basename, date_format)
+        except ValueError:
+            continue
+        start_of_week = file_date - timedelta(days=file_date.weekday())
+        return start_of_week.strftime("%Y-%m-%d")
+    return None
+
+
+def synthetic_filenames(count, seed=0):
+    # Mostly dated notes in both legacy formats, plus the misses a real notes
+    # directory has: other files, bad days, unknown month names
+    rng = random.Random(seed)
+    start = date(2015, 1, 1)
+    names = []
+    for _ in range(count):
+        day = start + timedelta(days=rng.randrange(3650))
+        kind = rng.random()
+        if kind < 0.45:
+            name = day.strftime('%a %b %d %Y')
+        elif kind < 0.8:
+            name = day.strftime('%b %d %Y')
+        elif kind < 0.85:
+            name = f'Feb {rng.randint(30, 31)} {day.year}'
+        elif kind < 0.9:
+            name = day.strftime('%B %d %Y')
+        else:
+            name = f'scratch-{rng.randrange(10 ** 6)}'
+        names.append(name + rng.choice(('', '', '.md', '.txt')))
+    return names
+
+
+def timed(parse, names):
+    start = time.perf_counter()
+    results = [parse(name) for name in names]
+    return time.perf_counter() - start, results
+
+
+def main(count):
+    names = synthetic_filenames(count)
+
+    reference_seconds, expected = timed(strptime_week_key, names)
+    note_dates.parse_note_date.cache_clear()
+    note_dates.week_key_for_filename.cache_clear()
+    cold_seconds, actual = timed(note_dates.week_key_for_filename, names)
+    warm_seconds, _ = timed(note_dates.week_key_for_filename, names)
+
+    mismatches = [(name, e, a) for name, e, a in zip(names, expected, actual) if e != a]
+    for name, e, a in mismatches[:10]:
+        print(f'MISMATCH {name!r}: strptime {e}, note_dates {a}')
+
+    print(f'{count} filenames, {sum(e is not None for e in expected)} dated')
+    print(f'strptime:          {reference_seconds * 1000:8.1f} ms')
+    print(f'note_dates (cold): {cold_seconds * 1000:8.1f} ms  ({reference_seconds / cold_seconds:.1f}x)')
+    print(f'note_dates (warm): {warm_seconds * 1000:8.1f} ms  ({reference_seconds / warm_seconds:.1f}x)')
+    print(f'{len(mismatches)} mismatches')
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
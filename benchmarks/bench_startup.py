@@ -0,0 +1,94 @@
+# Guards server start-up: imports app (and advice and summarize) in fresh
+# interpreters and checks that the import
+#   - finishes under --max-ms (median of --runs),
+#   - leaves openai, numpy and requests unloaded, and
+#   - opens no sockets, databases or files for writing.
+# Exits non-zero on any failure, so it can run in CI.
+#
+#   python benchmarks/bench_startup.py [--runs 5] [--max-ms 500] [--output startup.json]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HEAVY_MODULES = ('openai', 'numpy', 'requests', 'tiktoken', 'httpx', 'pydantic')
+
+# Runs in the child: time the import and record side effects through audit hooks
+CHILD = r'''
+import json, sys, time
+side_effects = []
+
+def audit(event, args):
+    if event == 'socket.connect':
+        side_effects.append(f'socket.connect {args[1]!r}')
+    elif event == 'sqlite3.connect':
+        side_effects.append(f'sqlite3.connect {args[0]!r}')
+    elif event == 'open' and args[1] is not None and any(flag in str(args[1]) for flag in 'wax+'):
+        side_effects.append(f'open {args[0]!r} {args[1]!r}')
+
+sys.addaudithook(audit)
+start = time.perf_counter()
+import app, advice, summarize
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'seconds': elapsed,
+    'loaded': [name for name in sys.argv[1:] if name in sys.modules],
+    'side_effects': side_effects,
+}))
+'''
+
+
+def run_once(env):
+    result = subprocess.run([sys.executable, '-c', CHILD, *HEAVY_MODULES], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    # The import must not print either; anything before the JSON line is a side effect
+    lines = result.stdout.strip().splitlines()
+    report = json.loads(lines[-1])
+    report['side_effects'] += [f'stdout {line!r}' for line in lines[:-1]]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=500, help='fail if the median import is slower')
+    parser.add_argument('--output', help='write the timings here as JSON')
+    args = parser.parse_args()
+
+    # A scratch HOME and an unroutable API endpoint, so any stray I/O is
+    # caught rather than touching real notes or the network
+    home = tempfile.mkdtemp(prefix='lifeos-startup-')
+    env = dict(os.environ, HOME=home, OPENAI_BASE_URL='http://127.0.0.1:9/v1', OPENAI_API_KEY='startup-check',
+               PYTHONDONTWRITEBYTECODE='1')
+    reports = [run_once(env) for _ in range(args.runs)]
+    samples = [report['seconds'] * 1000 for report in reports]
+    median = statistics.median(samples)
+
+    failures = []
+    if median > args.max_ms:
+        failures.append(f'median import {median:.1f} ms is over {args.max_ms:.0f} ms')
+    loaded = sorted({name for report in reports for name in report['loaded']})
+    if loaded:
+        failures.append(f'imported eagerly: {", ".join(loaded)}')
+    side_effects = sorted({effect for report in reports for effect in report['side_effects']})
+    failures += [f'side effect at import: {effect}' for effect in side_effects]
+    created = [os.path.join(root, name) for root, dirs, files in os.walk(home) for name in dirs + files]
+    failures += [f'created at import: {path}' for path in created]
+
+    print(f'import app: median {median:.1f} ms, min {min(samples):.1f} ms, max {max(samples):.1f} ms '
+          f'over {args.runs} runs')
+    for failure in failures:
+        print(f'FAIL {failure}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'samples_ms': samples, 'median_ms': median, 'max_ms': args.max_ms,
+                       'failures': failures}, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
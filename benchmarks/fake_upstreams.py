@@ -0,0 +1,149 @@
+# Local stand-ins for the OpenAI and Exa APIs, for benchmarks. Every request
+# sleeps for `latency` seconds (plus up to `jitter`) before answering with a
+# canned but well-formed response, so timings measure our side of the calls.
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUMMARY_FIELDS = ('context', 'overall_summary', 'ideas', 'dreams', 'life', 'gratitude', 'complaints',
+                  'questions', 'answers')
+ADVICE = {
+    'overall_advice': 'Keep going, but rest more.',
+    'relevant_quotes': ['"We suffer more often in imagination than in reality." (Letters, 13)'],
+    'praise': 'You show up every day.',
+    'criticism': 'You take on too much.',
+}
+
+
+def function_arguments(name, messages):
+    # Canned arguments for each function the app asks the model to call
+    if name == 'generate_summary':
+        text = messages[-1]['content'] if messages else ''
+        return {field: f'{field}: {len(text)} characters of notes' for field in SUMMARY_FIELDS}
+    if name == 'update_context':
+        return {'context': 'A person keeping a daily journal.'}
+    if name == 'provide_structured_advice':
+        return ADVICE
+    return {}
+
+
+def chat_completion(body):
+    messages = body.get('messages', [])
+    function_call = body.get('function_call')
+    usage = {'prompt_tokens': sum(len(str(m.get('content', ''))) for m in messages) // 4,
+             'completion_tokens': 50}
+    usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+    if isinstance(function_call, dict):
+        message = {'role': 'assistant', 'content': None, 'function_call': {
+            'name': function_call['name'],
+            'arguments': json.dumps(function_arguments(function_call['name'], messages)),
+        }}
+        finish_reason = 'function_call'
+    else:
+        message = {'role': 'assistant', 'content': 'A short reply from the fake model.'}
+        finish_reason = 'stop'
+    return {'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body.get('model', 'gpt-4'),
+            'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}],
+            'usage': usage}
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_chat(self, completion):
+        # Server-sent events, one word per chunk
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        words = (completion['choices'][0]['message']['content'] or '').split(' ')
+        for i, word in enumerate(words):
+            delta = {'content': word if i == 0 else f' {word}'}
+            chunk = {'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]}
+            self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+        done = {'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+        self.wfile.write(f'data: {json.dumps(done)}\n\ndata: [DONE]\n\n'.encode('utf-8'))
+        self.close_connection = True
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        server = self.server
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+        with server.lock:
+            server.requests[self.path] = server.requests.get(self.path, 0) + 1
+        if self.path.endswith('/chat/completions'):
+            completion = chat_completion(body)
+            if body.get('stream'):
+                self._stream_chat(completion)
+            else:
+                self._send_json(completion)
+        elif self.path.endswith('/embeddings'):
+            inputs = body.get('input', [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self._send_json({'object': 'list', 'model': body.get('model'), 'data': [
+                {'object': 'embedding', 'index': i, 'embedding': [random.random() for _ in range(1536)]}
+                for i in range(len(inputs))
+            ]})
+        elif self.path.endswith('/search'):
+            self._send_json({'results': [
+                {'title': f'Result {i}', 'url': f'https://example.com/{i}'} for i in range(body.get('numResults', 5))
+            ]})
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+
+class FakeUpstreams:
+    # One server answers both APIs: OpenAI under /v1, Exa at the root
+    def __init__(self, latency=0.05, jitter=0.0):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeUpstreamHandler)
+        self.server.daemon_threads = True
+        self.server.latency = latency
+        self.server.jitter = jitter
+        self.server.lock = threading.Lock()
+        self.server.requests = {}
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-upstreams', daemon=True)
+
+    @property
+    def openai_base_url(self):
+        return f'{self.url}/v1'
+
+    @property
+    def requests(self):
+        with self.server.lock:
+            return dict(self.server.requests)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    import sys
+    upstreams = FakeUpstreams(latency=float(sys.argv[1]) if len(sys.argv) > 1 else 0.05).start()
+    print(f'OPENAI_BASE_URL={upstreams.openai_base_url} EXA_BASE_URL={upstreams.url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        upstreams.stop()
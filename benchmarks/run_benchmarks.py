@@ -0,0 +1,289 @@
+# Benchmarks the note listing, the read endpoints the UI polls, advice
+# generation and end-to-end summarization against synthetic note
+# directories, with OpenAI and Exa replaced by local fake servers that add
+# a fixed latency. Results are written as JSON; pass --baseline with an
+# earlier results file to flag regressions.
+#
+#   python benchmarks/run_benchmarks.py --sizes 1000,10000,100000 --latency 0.05 \
+#       --output results.json [--baseline previous.json]
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_upstreams import FakeUpstreams
+from synthetic_notes import make_notes_dir
+
+PHILOSOPHERS = ['Seneca', 'Marcus Aurelius', 'Epictetus', 'Confucius', 'Simone de Beauvoir']
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+def stats(samples):
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'min': samples[0],
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'p99': percentile(samples, 99),
+        'max': samples[-1],
+        'mean': sum(samples) / len(samples),
+    }
+
+
+def measure(name, fn, repeat, setup=None, **labels):
+    # Times fn() `repeat` times (after setup(), untimed) and summarizes the seconds taken
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    result = {'name': name, **labels, **stats(samples)}
+    print(f'{name:<40} {labels} p50 {result["p50"] * 1000:9.2f} ms')
+    return result
+
+
+def load_test(name, send, requests_total, concurrency, **labels):
+    # Fires requests_total calls of send(session) from `concurrency` threads,
+    # each with its own keep-alive session; reports latency and throughput
+    import requests
+    local = threading.local()
+    errors = []
+
+    def one(_):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = send(local.session)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+        except requests.RequestException as e:
+            errors.append(str(e))
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(one, range(requests_total)))
+    elapsed = time.perf_counter() - start
+    result = {'name': name, **labels, 'concurrency': concurrency, **stats(samples),
+              'throughput_rps': requests_total / elapsed, 'errors': len(errors)}
+    print(f'{name:<40} {labels} c={concurrency} p50 {result["p50"] * 1000:9.2f} ms '
+          f'p99 {result["p99"] * 1000:9.2f} ms {result["throughput_rps"]:8.1f} req/s errors {len(errors)}')
+    return result
+
+
+def serve(flask_app):
+    from werkzeug.serving import make_server
+    # One access-log line per request would swamp the results
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def bench_listing(directory, size, repeat):
+    import manifest
+    import summarize
+    from storage import get_store
+
+    store = get_store(directory)
+
+    def drop_manifest():
+        if os.path.exists(os.path.join(store.directory, 'notes_manifest.json')):
+            os.remove(os.path.join(store.directory, 'notes_manifest.json'))
+
+    return [
+        measure('group_files_by_week', lambda: summarize.group_files_by_week(directory), repeat, size=size),
+        # Cold: no manifest, every note is hashed
+        measure('get_unsummarized_weeks.cold', lambda: summarize.get_unsummarized_weeks(directory),
+                max(1, repeat // 3), setup=drop_manifest, size=size),
+        measure('get_unsummarized_weeks.warm', lambda: summarize.get_unsummarized_weeks(directory), repeat,
+                size=size),
+        measure('manifest.refresh_files', lambda: manifest.refresh_files(directory, store.load_manifest()), repeat,
+                size=size),
+    ]
+
+
+def bench_read_endpoints(base_url, directory, size, requests_total, concurrency):
+    import requests
+    results = []
+    params = {'directory': directory}
+    results.append(load_test('GET /weekly_summaries', lambda s: s.get(
+        f'{base_url}/weekly_summaries', params=params), requests_total, concurrency, size=size))
+    results.append(load_test('GET /weekly_summaries?limit=20', lambda s: s.get(
+        f'{base_url}/weekly_summaries', params={**params, 'limit': 20}), requests_total, concurrency, size=size))
+    etag = requests.get(f'{base_url}/weekly_summaries', params=params).headers.get('ETag')
+    results.append(load_test('GET /weekly_summaries (304)', lambda s: s.get(
+        f'{base_url}/weekly_summaries', params=params, headers={'If-None-Match': etag or ''}),
+        requests_total, concurrency, size=size))
+
+    results.append(load_test('GET /unsummarized_count', lambda s: s.get(
+        f'{base_url}/unsummarized_count', params=params), requests_total, concurrency, size=size))
+    app_module = sys.modules['app']
+    app_module.WATCH_NOTES = True
+    try:
+        app_module.note_watcher(directory)
+        results.append(load_test('GET /unsummarized_count (watched)', lambda s: s.get(
+            f'{base_url}/unsummarized_count', params=params), requests_total, concurrency, size=size))
+    finally:
+        app_module.WATCH_NOTES = False
+        import watcher
+        watcher.watch(directory).stop()
+    return results
+
+
+def bench_advice(base_url, directory, requests_total, concurrency, latency):
+    payload = {'directory': directory, 'philosophers': PHILOSOPHERS, 'cache': False}
+    return [
+        load_test('POST /generate_advice', lambda s: s.post(f'{base_url}/generate_advice', json=payload),
+                  requests_total, concurrency, philosophers=len(PHILOSOPHERS), upstream_latency=latency),
+        load_test('POST /generate_advice (ndjson)', lambda s: s.post(
+            f'{base_url}/generate_advice', json={**payload, 'stream': True}),
+            requests_total, concurrency, philosophers=len(PHILOSOPHERS), upstream_latency=latency),
+    ]
+
+
+def bench_summarize(work_dir, notes, concurrencies, latency, upstreams):
+    import summarize
+    results = []
+    for concurrency in concurrencies:
+        directory = make_notes_dir(os.path.join(work_dir, f'summarize-{notes}-c{concurrency}'), notes, seed=1)
+        weeks = len(summarize.get_unsummarized_weeks(directory))
+        before = sum(upstreams.requests.values())
+        start = time.perf_counter()
+        summarize.summarize_new_notes(directory, concurrency=concurrency, use_cache=False)
+        elapsed = time.perf_counter() - start
+        calls = sum(upstreams.requests.values()) - before
+        result = {'name': 'summarize_new_notes', 'notes': notes, 'weeks': weeks, 'concurrency': concurrency,
+                  'upstream_latency': latency, 'seconds': elapsed, 'weeks_per_second': weeks / elapsed,
+                  'upstream_calls': calls}
+        print(f'{"summarize_new_notes":<40} notes={notes} weeks={weeks} c={concurrency} '
+              f'{elapsed:8.2f} s {result["weeks_per_second"]:7.1f} weeks/s {calls} calls')
+        results.append(result)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    labels = {k: v for k, v in result.items() if k in ('name', 'size', 'concurrency', 'notes', 'philosophers')}
+    return json.dumps(labels, sort_keys=True)
+
+
+def compare(results, baseline_path, threshold):
+    # Prints each result's time against the baseline's; returns the regressions
+    with open(baseline_path, 'r') as f:
+        baseline = {result_key(r): r for r in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result_key(result))
+        if previous is None:
+            continue
+        metric = 'p50' if 'p50' in result else 'seconds'
+        ratio = result[metric] / previous[metric] if previous[metric] else float('inf')
+        flag = 'REGRESSION' if ratio > 1 + threshold else ''
+        print(f'{result["name"]:<40} {metric} {previous[metric] * 1000:9.2f} -> {result[metric] * 1000:9.2f} ms '
+              f'({ratio:5.2f}x) {flag}')
+        if flag:
+            regressions.append(result_key(result))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000', help='notes per synthetic directory')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every fake upstream call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many extra seconds per call')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per function benchmark')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint load test')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients per load test')
+    parser.add_argument('--advice-requests', type=int, default=10)
+    parser.add_argument('--summarize-notes', type=int, default=1000, help='notes in the end-to-end summarize run')
+    parser.add_argument('--summarize-concurrency', default='1,4')
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown flagged as a regression')
+    parser.add_argument('--keep', action='store_true', help="don't delete the synthetic directories")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='lifeos-bench-')
+    upstreams = FakeUpstreams(args.latency, args.jitter).start()
+    # Everything the app reads at import time has to point at the fakes and the scratch directory first
+    os.environ.update({
+        'OPENAI_BASE_URL': upstreams.openai_base_url,
+        'OPENAI_API_KEY': 'benchmark',
+        'EXA_BASE_URL': upstreams.url,
+        'EXA_API_KEY': 'benchmark',
+        'LIFEOS_LLM_CACHE_PATH': os.path.join(work_dir, 'llm_cache.db'),
+        'LIFEOS_JOBS_PATH': os.path.join(work_dir, 'jobs.db'),
+        'LIFEOS_STORAGE': args.storage,
+    })
+    import app
+    server, base_url = serve(app.app)
+
+    results = []
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            print(f'Generating {size} notes')
+            directory = make_notes_dir(os.path.join(work_dir, f'notes-{size}'), size, summarized_fraction=0.9)
+            results += bench_listing(directory, size, args.repeat)
+            results += bench_read_endpoints(base_url, directory, size, args.requests, args.concurrency)
+        advice_dir = make_notes_dir(os.path.join(work_dir, 'advice'), 100, summarized_fraction=1.0)
+        results += bench_advice(base_url, advice_dir, args.advice_requests, min(args.concurrency, 4), args.latency)
+        results += bench_summarize(work_dir, args.summarize_notes,
+                                   [int(c) for c in args.summarize_concurrency.split(',')], args.latency, upstreams)
+    finally:
+        server.shutdown()
+        upstreams.stop()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.threshold)
+        print(f'{len(regressions)} regressions over {args.threshold:.0%}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+# Hammers many note directories from several processes at once, the way a
+# multi-worker gunicorn serving several users does, then checks that nothing
+# was lost or corrupted:
+#   - every summary upserted and every week marked summarized is still there,
+#   - every line appended through /write_file is present exactly once,
+#   - a counter bumped with If-Match read-modify-writes equals the number of
+#     successful bumps,
+#   - advice.json and the search index load, with each week indexed once,
+#   - no two processes ever held a directory's summarize lock together.
+# Exits non-zero on any failure.
+#
+#   python benchmarks/stress_locks.py [--dirs 8] [--processes 6] [--threads 4] [--ops 150] [--storage json]
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+OPS = ('summary', 'mark', 'dirty', 'append', 'counter', 'advice', 'index', 'run')
+
+
+def worker(worker_id, directories, threads, ops, seed):
+    # Runs in its own interpreter; returns what it did so the parent can check for it
+    import app
+    import locks
+    import manifest
+    import search
+    from storage import get_store
+
+    done = {'summaries': [], 'marked': [], 'indexed': [], 'appended': [], 'counter': {}, 'overlaps': 0,
+            'busy': 0, 'ops': 0}
+    done_lock = threading.Lock()
+
+    def run_thread(thread_id):
+        rng = random.Random(seed * 1000 + thread_id)
+        client = app.app.test_client()
+        for n in range(ops):
+            directory = rng.choice(directories)
+            op = rng.choice(OPS)
+            tag = f'{worker_id}-{thread_id}-{n}'
+            week = f'stress-{tag}'
+            if op == 'summary':
+                get_store(directory).upsert_summary(
+                    {'week': week, 'timestamp': rng.random(), 'summary': {'overall_summary': tag}, 'files': []})
+                record = ('summaries', [directory, week])
+            elif op == 'mark':
+                manifest.mark_week_summarized(directory, week, {})
+                record = ('marked', [directory, week])
+            elif op == 'dirty':
+                manifest.get_dirty_weeks(directory)
+                record = None
+            elif op == 'append':
+                response = client.post('/write_file', json={'path': os.path.join(directory, '.stress-log.txt'),
+                                                            'append': f'{tag} {"x" * rng.randint(0, 200)}\n'})
+                assert response.status_code == 200, response.get_json()
+                record = ('appended', [directory, tag])
+            elif op == 'counter':
+                path = os.path.join(directory, '.stress-counter.txt')
+                while True:
+                    read = client.get('/read_file', query_string={'path': path})
+                    value = int(read.get_json()['content'] or 0)
+                    response = client.post('/write_file', json={'path': path, 'content': str(value + 1)},
+                                           headers={'If-Match': read.headers['ETag']})
+                    if response.status_code != 412:
+                        assert response.status_code == 200, response.get_json()
+                        break
+                record = ('counter', directory)
+            elif op == 'advice':
+                get_store(directory).save_advice([{'philosopher': tag, 'advice': 'x' * rng.randint(0, 2000)}])
+                record = None
+            elif op == 'index':
+                search.index_week(directory, {'week': week, 'summary': {'ideas': f'ideas from {tag}'}}, {})
+                record = ('indexed', [directory, week])
+            else:
+                # Mutual exclusion check: a marker only one holder at a time may create
+                try:
+                    with locks.get_lock(directory, 'summarize').write(timeout=0):
+                        marker = os.path.join(directory, '.stress-run')
+                        try:
+                            fd = os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                        except FileExistsError:
+                            with done_lock:
+                                done['overlaps'] += 1
+                        else:
+                            os.close(fd)
+                            time.sleep(0.002)
+                            os.remove(marker)
+                except locks.LockTimeout:
+                    with done_lock:
+                        done['busy'] += 1
+                record = None
+            with done_lock:
+                done['ops'] += 1
+                if record and record[0] == 'counter':
+                    done['counter'][record[1]] = done['counter'].get(record[1], 0) + 1
+                elif record:
+                    done[record[0]].append(record[1])
+
+    pool = [threading.Thread(target=run_thread, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return done
+
+
+def check(directories, results):
+    import search
+    from storage import get_store
+
+    failures = []
+    expected = {key: {d: set() for d in directories} for key in ('summaries', 'marked', 'indexed', 'appended')}
+    counters = {d: 0 for d in directories}
+    for result in results:
+        for key in expected:
+            for directory, item in result[key]:
+                expected[key][directory].add(item)
+        for directory, count in result['counter'].items():
+            counters[directory] += count
+        if result['overlaps']:
+            failures.append(f'{result["overlaps"]} overlapping holds of a summarize lock')
+
+    for directory in directories:
+        name = os.path.basename(directory)
+        store = get_store(directory)
+        try:
+            weeks = {summary['week'] for summary in store.load_summaries()}
+            missing = expected['summaries'][directory] - weeks
+            if missing:
+                failures.append(f'{name}: {len(missing)} summaries lost, e.g. {sorted(missing)[0]}')
+            summarized = store.load_manifest()['summarized'] or {}
+            missing = expected['marked'][directory] - set(summarized)
+            if missing:
+                failures.append(f'{name}: {len(missing)} weeks lost from the manifest, e.g. {sorted(missing)[0]}')
+            try:
+                store.load_advice()
+            except FileNotFoundError:
+                pass
+        except ValueError as e:
+            failures.append(f'{name}: corrupt store: {str(e)}')
+
+        log_path = os.path.join(directory, '.stress-log.txt')
+        lines = open(log_path, encoding='utf-8').read().splitlines() if os.path.exists(log_path) else []
+        tags = [line.split(' ', 1)[0] for line in lines]
+        if sorted(tags) != sorted(expected['appended'][directory]):
+            failures.append(f'{name}: {len(lines)} appended lines, expected {len(expected["appended"][directory])}')
+        if any(line.split(' ', 1)[1:] and set(line.split(' ', 1)[1]) - {'x'} for line in lines):
+            failures.append(f'{name}: interleaved appends')
+
+        counter_path = os.path.join(directory, '.stress-counter.txt')
+        value = int(open(counter_path).read() or 0) if os.path.exists(counter_path) else 0
+        if value != counters[directory]:
+            failures.append(f'{name}: counter is {value} after {counters[directory]} increments')
+
+        index = search.get_index(directory)
+        if expected['indexed'][directory]:
+            index.load()
+            alive = [item['week'] for item, alive in zip(index.items, index.alive) if alive]
+            if sorted(alive) != sorted(expected['indexed'][directory]):
+                failures.append(f'{name}: search index has {len(alive)} live rows for '
+                                f'{len(expected["indexed"][directory])} indexed weeks')
+
+        leftovers = [filename for filename in os.listdir(directory) if filename.endswith('.tmp')]
+        if leftovers:
+            failures.append(f'{name}: temp files left behind: {", ".join(leftovers)}')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dirs', type=int, default=8, help='note directories to spread the load over')
+    parser.add_argument('--processes', type=int, default=6)
+    parser.add_argument('--threads', type=int, default=4, help='threads per process')
+    parser.add_argument('--ops', type=int, default=150, help='operations per thread')
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help="don't delete the scratch directory")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='lifeos-stress-')
+    # Set before any worker imports the app, so every process shares them
+    os.environ.update({
+        'LIFEOS_STORAGE': args.storage,
+        'LIFEOS_LOCK_DIR': os.path.join(work_dir, 'locks'),
+        'LIFEOS_LLM_CACHE_PATH': os.path.join(work_dir, 'llm_cache.db'),
+        'LIFEOS_JOBS_PATH': os.path.join(work_dir, 'jobs.db'),
+        'LIFEOS_EMBEDDER': 'hashing',
+    })
+    from synthetic_notes import make_notes_dir
+    directories = [make_notes_dir(os.path.join(work_dir, f'notes-{i}'), 20, seed=i) for i in range(args.dirs)]
+    # A summarized directory: with no summaries at all, a refresh would rightly
+    # drop the weeks marked summarized. The stress files are hidden, so they
+    # aren't taken for notes.
+    import manifest
+    from storage import get_store
+    for directory in directories:
+        get_store(directory).upsert_summary({'week': 'seed', 'timestamp': 0, 'summary': {}, 'files': []})
+        manifest.get_dirty_weeks(directory)
+        with open(os.path.join(directory, '.stress-counter.txt'), 'w') as f:
+            f.write('0')
+
+    failures = []
+    try:
+        start = time.perf_counter()
+        with multiprocessing.get_context('spawn').Pool(args.processes) as pool:
+            results = pool.starmap(worker, [(i, directories, args.threads, args.ops, args.seed * 100 + i)
+                                            for i in range(args.processes)])
+        elapsed = time.perf_counter() - start
+        total = sum(result['ops'] for result in results)
+        busy = sum(result['busy'] for result in results)
+        print(f'{total} operations on {args.dirs} directories from {args.processes} processes x '
+              f'{args.threads} threads in {elapsed:.2f} s ({total / elapsed:.0f} ops/s, '
+              f'{busy} summarize lock attempts found it busy)')
+        failures = check(directories, results)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        else:
+            print(f'Kept {work_dir}')
+
+    for failure in failures:
+        print(f'FAIL {failure}')
+    if not failures:
+        print('OK: no lost updates or corrupt files')
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
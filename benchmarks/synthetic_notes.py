@@ -0,0 +1,81 @@
+# Generates a notes directory shaped like a real one, for benchmarks: one
+# note per day per journal, in both legacy filename formats, with journals
+# beyond the first kept in subdirectories, and optionally summaries for a
+# share of the weeks already in the store.
+#
+#   python benchmarks/synthetic_notes.py <directory> [count]
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import manifest
+from storage import atomic_write_json, get_store
+
+WORDS = ('slept', 'walked', 'read', 'wrote', 'called', 'cooked', 'worried', 'planned', 'ran', 'laughed',
+         'work', 'family', 'friends', 'project', 'garden', 'book', 'music', 'city', 'weather', 'sleep',
+         'tired', 'happy', 'anxious', 'calm', 'grateful', 'curious', 'stuck', 'hopeful')
+DAYS_PER_JOURNAL = 3650
+
+
+def note_text(rng, words):
+    sentences = []
+    while words > 0:
+        length = rng.randint(6, 16)
+        sentences.append(' '.join(rng.choice(WORDS) for _ in range(length)).capitalize() + '.')
+        words -= length
+    paragraphs = [' '.join(sentences[i:i + 4]) for i in range(0, len(sentences), 4)]
+    return '\n\n'.join(paragraphs)
+
+
+def make_notes_dir(directory, count, words_per_note=150, summarized_fraction=0.0, seed=0):
+    # Writes `count` notes under `directory` and returns it. Weeks picked for
+    # summarized_fraction get a stored summary and are marked summarized in
+    # the manifest, the way a directory that's mostly caught up looks.
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    start = date(2015, 1, 5)
+    for i in range(count):
+        journal, offset = divmod(i, DAYS_PER_JOURNAL)
+        day = start + timedelta(days=offset)
+        name = day.strftime('%a %b %d %Y' if rng.random() < 0.5 else '%b %d %Y')
+        folder = os.path.join(directory, f'journal-{journal}') if journal else directory
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, name), 'w', encoding='utf-8') as f:
+            f.write(note_text(rng, rng.randint(words_per_note // 2, words_per_note * 3 // 2)))
+
+    if summarized_fraction > 0:
+        store = get_store(directory)
+        dirty = manifest.get_dirty_weeks(directory)
+        notes_manifest = store.load_manifest()
+        entries = []
+        for week in sorted(dirty):
+            if rng.random() >= summarized_fraction:
+                continue
+            files = dirty[week]
+            summary = {field: f'{field} for the week of {week}: ' + note_text(rng, 40)
+                       for field in ('context', 'overall_summary', 'ideas', 'dreams', 'life', 'gratitude',
+                                     'complaints', 'questions', 'answers')}
+            entries.append({
+                'week': week,
+                'timestamp': time.mktime(time.strptime(week, '%Y-%m-%d')),
+                'summary': summary,
+                'files': files,
+            })
+            notes_manifest['summarized'][week] = manifest.week_hash(
+                {name: notes_manifest['files'][name]['hash'] for name in files})
+        # Written in bulk; upserting week by week would rewrite the JSON store each time
+        if store.backend == 'json':
+            atomic_write_json(store.paths['summaries'], entries, indent=4)
+        else:
+            for entry in entries:
+                store.upsert_summary(entry)
+        store.save_manifest(notes_manifest, changed_files=set(), changed_weeks={e['week'] for e in entries})
+    return directory
+
+
+if __name__ == "__main__":
+    make_notes_dir(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
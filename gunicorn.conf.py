@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+# gunicorn app:app
+# Streaming /chat responses hold a connection open for the whole generation,
+# so use gevent workers (one greenlet per open stream) when gevent is
+# installed, and threaded workers otherwise, rather than one sync worker per stream.
+try:
+    import gevent  # noqa: F401
+    worker_class = 'gevent'
+    worker_connections = 1000
+except ImportError:
+    worker_class = 'gthread'
+    threads = 16
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Workers share their metrics through snapshots here, so /metrics covers all
+# of them whichever one answers; see metrics.py. A fresh directory per server
+# start, unless LIFEOS_METRICS_DIR is set.
+os.environ.setdefault('LIFEOS_METRICS_DIR', tempfile.mkdtemp(prefix='lifeos-metrics-'))
+# Summarization and long generations can take minutes
+timeout = 300
+
+
+def post_worker_init(worker):
+    # Load the OpenAI SDK, numpy etc. in the background of each worker; see /ready
+    import app
+    import metrics
+    app.start_warm_up()
+    metrics.start_snapshots()
+
+
+def worker_exit(server, worker):
+    # Keep what this worker counted; /metrics goes on including it
+    import metrics
+    if metrics.METRICS_DIR:
+        metrics.write_snapshot()
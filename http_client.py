@@ -0,0 +1,199 @@
+import os
+import random
+import threading
+import time
+
+import metrics
+from lazy_imports import lazy_import
+
+requests = lazy_import('requests')
+
+# Responses worth retrying: rate limiting and transient upstream failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class UpstreamBusy(Exception):
+    # Every slot of max_concurrency stayed taken (by open streams, say) for
+    # queue_timeout seconds; worth retrying shortly
+    def __init__(self, name, timeout):
+        super().__init__(f'All connections to {name} are busy; gave up after waiting {timeout:g}s')
+        self.name = name
+
+
+class UpstreamMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.statuses = {}
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+
+    def observe(self, seconds, status=None, retried=False):
+        # status is None when the attempt failed without a response
+        with self.lock:
+            self.requests += 1
+            if retried:
+                self.retries += 1
+            if status is None:
+                self.failures += 1
+            else:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.latency_sum += seconds
+            self.latency_count += 1
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    self.latency_buckets[i] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'failures': self.failures,
+                'statuses': dict(self.statuses),
+                'latency_buckets': dict(zip(LATENCY_BUCKETS, self.latency_buckets)),
+                'latency_sum': self.latency_sum,
+                'latency_count': self.latency_count,
+            }
+
+
+class Upstream:
+    # A keep-alive session for one upstream API, with a (connect, read)
+    # timeout, at most max_concurrency requests in flight, and retries with
+    # jittered exponential backoff on connection errors, 429s and 5xxs.
+    # Read timeouts aren't retried: the upstream may already be generating
+    # (and billing) a completion, and a hung upstream would hold the worker
+    # for every attempt's timeout. Waiting for a free slot is capped at
+    # queue_timeout (by default the connect timeout), then UpstreamBusy is raised.
+    def __init__(self, name, base_url, timeout=(5, 60), max_retries=3, backoff=0.5, max_backoff=20,
+                 max_concurrency=8, queue_timeout=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.metrics = UpstreamMetrics()
+        self.max_concurrency = max_concurrency
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        if queue_timeout is None:
+            queue_timeout = timeout[0] if isinstance(timeout, tuple) else timeout
+        self.queue_timeout = queue_timeout
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Created on first use, so importing this module doesn't load requests
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def _delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        # Full jitter, so workers that failed together don't retry together
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method, path, **kwargs):
+        # Returns the final requests.Response (callers still raise_for_status),
+        # or raises the last requests.RequestException once retries run out,
+        # or UpstreamBusy if no slot frees up within queue_timeout.
+        # With stream=True the response keeps its slot in max_concurrency
+        # until it's closed, so callers must close it.
+        kwargs.setdefault('timeout', self.timeout)
+        url = f'{self.base_url}{path}'
+        if not self.semaphore.acquire(timeout=self.queue_timeout):
+            raise UpstreamBusy(self.name, self.queue_timeout)
+        response = None
+        try:
+            response = self._attempts(method, url, **kwargs)
+        finally:
+            if response is None or not kwargs.get('stream'):
+                self.semaphore.release()
+        if kwargs.get('stream'):
+            self._release_on_close(response)
+        return response
+
+    def _attempts(self, method, url, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            retry = attempt < self.max_retries
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.ConnectionError:
+                # Includes ConnectTimeout: the request never reached the upstream
+                self.metrics.observe(time.perf_counter() - start, retried=retry)
+                if not retry:
+                    raise
+                time.sleep(self._delay(attempt))
+                continue
+            except requests.RequestException:
+                self.metrics.observe(time.perf_counter() - start)
+                raise
+            retry = retry and response.status_code in RETRY_STATUSES
+            self.metrics.observe(time.perf_counter() - start, response.status_code, retried=retry)
+            if not retry:
+                return response
+            response.close()
+            time.sleep(self._delay(attempt, response))
+
+    def _release_on_close(self, response):
+        close = response.close
+        released = threading.Lock()
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                # Closing twice must not release the slot twice
+                if released.acquire(blocking=False):
+                    self.semaphore.release()
+        response.close = close_and_release
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+
+openai = Upstream('openai', os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1'), timeout=(5, 120))
+exa = Upstream('exa', os.environ.get('EXA_BASE_URL', 'https://api.exa.ai'), timeout=(5, 30))
+upstreams = {upstream.name: upstream for upstream in (openai, exa)}
+
+
+def metrics_snapshot():
+    return {name: upstream.metrics.snapshot() for name, upstream in upstreams.items()}
+
+
+@metrics.registry.register_collector
+def collect_upstream_metrics():
+    durations, requests_total, retries, failures = [], [], [], []
+    for name, snapshot in metrics_snapshot().items():
+        labels = {'upstream': name}
+        durations.extend(metrics.histogram_samples(
+            'lifeos_upstream_request_duration_seconds', labels, snapshot['latency_buckets'].items(),
+            snapshot['latency_sum'], snapshot['latency_count'], cumulative=True))
+        for status, count in sorted(snapshot['statuses'].items()):
+            requests_total.append(('lifeos_upstream_responses_total', {**labels, 'status': status}, count))
+        retries.append(('lifeos_upstream_retries_total', labels, snapshot['retries']))
+        failures.append(('lifeos_upstream_failures_total', labels, snapshot['failures']))
+    return [
+        ('lifeos_upstream_request_duration_seconds', 'histogram', 'Upstream API attempts, retries included', durations),
+        ('lifeos_upstream_responses_total', 'counter', 'Upstream API responses by status', requests_total),
+        ('lifeos_upstream_retries_total', 'counter', 'Upstream API attempts that were retried', retries),
+        ('lifeos_upstream_failures_total', 'counter', 'Upstream API attempts that got no response', failures),
+    ]
@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+import summarize
+
+# Jobs still holding their directory; a new request for it joins the existing job
+ACTIVE_STATUSES = ('queued', 'running')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    pid INTEGER,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    weeks_total INTEGER,
+    weeks_done INTEGER NOT NULL DEFAULT 0,
+    weeks TEXT NOT NULL DEFAULT '[]',
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    profile_path TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_directory_status ON jobs (directory, status);
+"""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    # Summarization runs queued per notes directory and run on a small thread
+    # pool. Job state lives in SQLite so any worker process can report on or
+    # cancel a job, and a second request for a directory that already has a
+    # queued or running job gets that job back instead of starting another.
+    def __init__(self, path, max_workers=2):
+        self.path = path
+        self.max_workers = max_workers
+        self._db = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # Opened on first use; stale jobs from dead processes are settled then
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript(SCHEMA)
+            # Databases from before profiling was added
+            if 'profile_path' not in {row[1] for row in db.execute('PRAGMA table_info(jobs)')}:
+                db.execute('ALTER TABLE jobs ADD COLUMN profile_path TEXT')
+            db.row_factory = sqlite3.Row
+            self._db = db
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+            self.recover()
+        return self._db
+
+    def _update(self, job_id, **fields):
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._lock:
+            self._connection().execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def recover(self):
+        # A queued or running job whose process is gone will never finish.
+        # Summaries are committed week by week, so resubmitting resumes it.
+        rows = self._db.execute(
+            f'SELECT id, pid FROM jobs WHERE status IN {ACTIVE_STATUSES}').fetchall()
+        for row in rows:
+            if row['pid'] is None or not _pid_alive(row['pid']):
+                self._db.execute("UPDATE jobs SET status = 'interrupted', finished = ? WHERE id = ?",
+                                 (time.time(), row['id']))
+
+    def submit(self, directory, profile=False, **params):
+        # Returns (job, created); created is False when an active job for the
+        # same directory was returned instead. profile runs the job under
+        # cProfile, with the stats written to the job's profile_path.
+        directory = os.path.realpath(os.path.expanduser(directory))
+        with self._lock:
+            db = self._connection()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute(
+                    f'SELECT id FROM jobs WHERE directory = ? AND status IN {ACTIVE_STATUSES} '
+                    'ORDER BY created LIMIT 1', (directory,)).fetchone()
+                if row is None:
+                    job_id = uuid.uuid4().hex
+                    profiler = profiling.Profile(f'job-{job_id}') if profile else None
+                    db.execute('INSERT INTO jobs (id, directory, params, status, pid, created, profile_path) '
+                               "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                               (job_id, directory, json.dumps(params), os.getpid(), time.time(),
+                                profiler.path if profiler else None))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        if row is not None:
+            return self.get(row['id']), False
+        self._executor.submit(self._run, job_id, directory, params, profiler)
+        return self.get(job_id), True
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['weeks'] = json.loads(job['weeks'])
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        job['eta_seconds'] = None
+        if job['status'] == 'running' and job['weeks_done'] and job['weeks_total']:
+            elapsed = time.time() - job['started']
+            job['eta_seconds'] = elapsed / job['weeks_done'] * (job['weeks_total'] - job['weeks_done'])
+        return job
+
+    def cancel(self, job_id):
+        # A queued job is cancelled outright; a running one stops before its next week
+        with self._lock:
+            db = self._connection()
+            db.execute("UPDATE jobs SET status = 'cancelled', finished = ?, cancel_requested = 1 "
+                       "WHERE id = ? AND status = 'queued'", (time.time(), job_id))
+            db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+        return self.get(job_id)
+
+    def _cancel_requested(self, job_id):
+        with self._lock:
+            row = self._connection().execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def _run(self, job_id, directory, params, profiler=None):
+        if self._cancel_requested(job_id):
+            return
+        if profiler is not None and not profiler.start():
+            print(f'Not profiling job {job_id}: another profile is running')
+            self._update(job_id, profile_path=None)
+            profiler = None
+        try:
+            self._run_job(job_id, directory, params)
+        finally:
+            if profiler is not None:
+                profiler.finish()
+
+    def _run_job(self, job_id, directory, params):
+        self._update(job_id, status='running', started=time.time())
+        weeks = []
+        totals = [0]
+
+        def progress(week, done, total):
+            totals[0] = total
+            if week is not None:
+                weeks.append({'week': week, 'finished': time.time()})
+            self._update(job_id, weeks_total=total, weeks_done=done, weeks=json.dumps(weeks))
+
+        try:
+            summarize.summarize_new_notes(directory, progress=progress,
+                                          should_cancel=lambda: self._cancel_requested(job_id), **params)
+        except Exception as e:
+            print(f'Summarization job {job_id} failed: {str(e)}')
+            self._update(job_id, status='failed', finished=time.time(), error=str(e))
+            return
+        status = 'cancelled' if len(weeks) < totals[0] else 'succeeded'
+        self._update(job_id, status=status, finished=time.time())
+
+
+queue = JobQueue(
+    os.path.expanduser(os.environ.get('LIFEOS_JOBS_PATH', '~/.cache/lifeos/jobs.db')),
+    max_workers=int(os.environ.get('LIFEOS_JOB_WORKERS', 2)),
+)
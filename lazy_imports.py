@@ -0,0 +1,37 @@
+import importlib
+import importlib.util
+import threading
+
+
+class LazyModule:
+    # Stands in for a module until one of its attributes is first used, so
+    # heavy dependencies (openai, requests, numpy) cost nothing at import time.
+    # Its own methods are prefixed so they can't shadow the module's (numpy.load).
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _lazy_load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def _lazy_loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._lazy_load(), attr)
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}{"" if self._lazy_loaded else " (not loaded)"}>'
+
+
+def lazy_import(name):
+    # A LazyModule for `name`, or None if it isn't installed (checked without importing it)
+    if importlib.util.find_spec(name) is None:
+        return None
+    return LazyModule(name)
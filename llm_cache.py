@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# Request parameters that change the completion; everything else (stream,
+# timeouts, ...) is left out of the key
+KEY_PARAMS = ('model', 'messages', 'functions', 'function_call', 'tools', 'tool_choice',
+              'temperature', 'top_p', 'max_tokens', 'response_format', 'seed')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used);
+"""
+
+
+def cache_key(params):
+    fingerprint = {name: params[name] for name in KEY_PARAMS if params.get(name) is not None}
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    # Completed chat responses on disk in SQLite, keyed by a fingerprint of
+    # the request. Entries expire after ttl seconds, and the least recently
+    # used ones are evicted once the cache holds more than max_bytes.
+    def __init__(self, path, ttl=30 * 24 * 3600, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # Opened on first use so importing this module never touches disk
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            row = db.execute('SELECT response, created FROM completions WHERE key = ?', (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    db.execute('DELETE FROM completions WHERE key = ?', (key,))
+                self.misses += 1
+                return None
+            db.execute('UPDATE completions SET last_used = ? WHERE key = ?', (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, response):
+        body = json.dumps(response)
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            db.execute('INSERT OR REPLACE INTO completions (key, response, size, created, last_used) VALUES (?, ?, ?, ?, ?)',
+                       (key, body, len(body), now, now))
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM completions').fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(db, total - self.max_bytes)
+
+    def _evict(self, db, excess):
+        db.execute('DELETE FROM completions WHERE created < ?', (time.time() - self.ttl,))
+        freed = 0
+        evicted = []
+        for key, size in db.execute('SELECT key, size FROM completions ORDER BY last_used'):
+            if freed >= excess:
+                break
+            evicted.append((key,))
+            freed += size
+        db.executemany('DELETE FROM completions WHERE key = ?', evicted)
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute('DELETE FROM completions')
+
+
+cache = LLMCache(
+    os.path.expanduser(os.environ.get('LIFEOS_LLM_CACHE_PATH', '~/.cache/lifeos/llm_cache.db')),
+    ttl=float(os.environ.get('LIFEOS_LLM_CACHE_TTL', 30 * 24 * 3600)),
+    max_bytes=int(os.environ.get('LIFEOS_LLM_CACHE_BYTES', 256 * 1024 * 1024)),
+)
+
+metrics.registry.register_collector(metrics.cache_collector('llm', cache))
+
+
+def cached_call(params, call, use_cache=True):
+    # Returns call(params) as a plain dict, from the cache when the same
+    # request has been answered before. use_cache=False skips the lookup but
+    # still stores the fresh response.
+    key = cache_key(params)
+    if use_cache:
+        response = cache.get(key)
+        if response is not None:
+            return response
+    start = time.perf_counter()
+    response = call(params)
+    model = params.get('model', '')
+    metrics.llm_requests.observe(time.perf_counter() - start, model=model)
+    if hasattr(response, 'model_dump'):
+        response = response.model_dump()
+    usage = response.get('usage') or {}
+    for token_type in ('prompt', 'completion'):
+        if usage.get(f'{token_type}_tokens'):
+            metrics.llm_tokens.inc(usage[f'{token_type}_tokens'], model=model, type=token_type)
+    cache.put(key, response)
+    return response
+
+
+def chat_completion(client, use_cache=True, **params):
+    # client is anything with chat.completions.create: an OpenAI() client,
+    # the openai module itself, or a stub in tests
+    return cached_call(params, lambda p: client.chat.completions.create(**p), use_cache)
@@ -0,0 +1,108 @@
+import contextlib
+import fcntl
+import hashlib
+import os
+import threading
+import time
+
+import metrics
+
+# Lock files live outside the notes directories, so any path (a notes
+# directory, a single note) can be locked without writing next to it.
+# Every process that should coordinate needs the same LIFEOS_LOCK_DIR.
+LOCK_DIR = os.path.expanduser(os.environ.get('LIFEOS_LOCK_DIR', '~/.cache/lifeos/locks'))
+# Seconds to wait for a lock before giving up with LockTimeout
+LOCK_TIMEOUT = float(os.environ.get('LIFEOS_LOCK_TIMEOUT', 60))
+
+lock_wait = metrics.registry.histogram(
+    'lifeos_lock_wait_seconds', 'Time spent waiting to acquire directory and file locks', ('lock', 'mode'))
+
+# (name, resolved path) -> lock
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+class LockTimeout(Exception):
+    def __init__(self, name, path, timeout):
+        if timeout:
+            message = f'Timed out after {timeout:g}s waiting for the {name} lock on {path}'
+        else:
+            message = f'The {name} lock on {path} is already held'
+        super().__init__(message)
+        self.name = name
+        self.path = path
+
+
+class ReadWriteLock:
+    # A reader/writer lock on `path` shared by every thread and process: flock
+    # on a lock file, LOCK_SH to read and LOCK_EX to write. Each acquisition
+    # opens the file afresh, and flock locks held through different open files
+    # conflict even within one process, so threads exclude each other the same
+    # way processes do. Re-entrant per thread (a read inside a write is fine);
+    # upgrading a read to a write would deadlock, so it raises instead.
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.lock_path = os.path.join(
+            LOCK_DIR, f'{name}-{hashlib.sha1(path.encode("utf-8")).hexdigest()[:20]}.lock')
+        self._held = threading.local()
+
+    def read(self, timeout=None):
+        return self._hold(fcntl.LOCK_SH, timeout)
+
+    def write(self, timeout=None):
+        # timeout=0 tries once and raises LockTimeout if anyone else holds the lock
+        return self._hold(fcntl.LOCK_EX, timeout)
+
+    @contextlib.contextmanager
+    def _hold(self, operation, timeout):
+        held = getattr(self._held, 'operation', None)
+        if held == fcntl.LOCK_EX or held == operation:
+            yield
+            return
+        if held is not None:
+            raise RuntimeError(f"Can't take the {self.name} write lock on {self.path} while holding its read lock")
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self._acquire(fd, operation, LOCK_TIMEOUT if timeout is None else timeout)
+            self._held.operation = operation
+            try:
+                yield
+            finally:
+                self._held.operation = None
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
+
+    def _acquire(self, fd, operation, timeout):
+        start = time.perf_counter()
+        deadline = start + timeout
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(fd, operation | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise LockTimeout(self.name, self.path, timeout)
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.05)
+        lock_wait.observe(time.perf_counter() - start, lock=self.name,
+                          mode='write' if operation == fcntl.LOCK_EX else 'read')
+
+
+def get_lock(path, name='store'):
+    # name separates independent locks on one path: 'store' guards the
+    # summaries, advice and manifest of a notes directory, 'search' its search
+    # index, 'summarize' a summarization run, and 'file' a single note
+    path = os.path.realpath(os.path.expanduser(path))
+    key = (name, path)
+    lock = _locks.get(key)
+    if lock is None:
+        with _locks_lock:
+            lock = _locks.get(key)
+            if lock is None:
+                lock = _locks[key] = ReadWriteLock(name, path)
+    return lock
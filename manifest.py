@@ -0,0 +1,133 @@
+import hashlib
+import os
+
+import locks
+import metrics
+from note_dates import is_note_filename, week_key_for_filename
+from storage import RESERVED_FILENAMES, get_store
+
+def iter_note_entries(directory, prefix=''):
+    # (name, DirEntry) for every file under `directory`, where name is the path
+    # relative to it ('journal/Nov 25 2024' for notes in subdirectories).
+    # Hidden files and directories (.lifeos, temp files), the stores' own
+    # files at the top level, and attachments (images, PDFs) are skipped.
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            name = f'{prefix}{entry.name}'
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_note_entries(entry.path, f'{name}/')
+            elif name not in RESERVED_FILENAMES and is_note_filename(name) and entry.is_file():
+                yield name, entry
+
+
+def hash_bytes(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def hash_file(path):
+    digest = hashlib.blake2b(digest_size=16)
+    size = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+            size += len(block)
+    metrics.file_io_bytes.inc(size, op='read', kind='notes')
+    return digest.hexdigest()
+
+
+def week_hash(file_hashes):
+    # Filenames are part of the hash, so a rename marks the week dirty too
+    digest = hashlib.blake2b(digest_size=16)
+    for filename in sorted(file_hashes):
+        digest.update(f'{filename}\0{file_hashes[filename]}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def refresh_files(directory, manifest):
+    # One stat per file; only files whose mtime or size moved are rehashed.
+    # Returns the names of the files whose records changed.
+    files = manifest['files']
+    seen = set()
+    changed = set()
+    for name, entry in iter_note_entries(directory):
+        seen.add(name)
+        st = entry.stat()
+        record = files.get(name)
+        if record and record['mtime_ns'] == st.st_mtime_ns and record['size'] == st.st_size:
+            continue
+        week = record['week'] if record else week_key_for_filename(name)
+        if week is None and not record:
+            print(f'Error processing file {name}: Unable to parse date from filename: {name}')
+        files[name] = {
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'hash': hash_file(entry.path) if week else None,
+            'week': week,
+        }
+        changed.add(name)
+    for name in list(files):
+        if name not in seen:
+            del files[name]
+            changed.add(name)
+    return changed
+
+
+def current_weeks(manifest):
+    # week -> {filename: content hash}
+    weeks = {}
+    for name, record in manifest['files'].items():
+        if record['week']:
+            weeks.setdefault(record['week'], {})[name] = record['hash']
+    return weeks
+
+
+def bootstrap_summarized(manifest, store, weeks):
+    # First run against existing summaries: trust those whose recorded file
+    # list still matches the directory, like the old file-count check did.
+    summarized = {}
+    for summary in store.load_summaries():
+        week = summary['week']
+        if week in weeks and set(summary.get('files', [])) == set(weeks[week]):
+            summarized[week] = week_hash(weeks[week])
+    manifest['summarized'] = summarized
+
+
+def get_dirty_weeks(directory):
+    # week -> sorted filenames, for every week whose notes changed since it was summarized
+    store = get_store(directory)
+    # Refreshes mutate the store's cached manifest in place and write it back,
+    # so they hold the directory's store lock (across workers, too)
+    with locks.get_lock(store.directory).write():
+        manifest = store.load_manifest()
+        changed_files = refresh_files(store.directory, manifest)
+        weeks = current_weeks(manifest)
+        changed_weeks = set()
+        if manifest['summarized'] is None:
+            bootstrap_summarized(manifest, store, weeks)
+            changed_weeks = None
+        elif manifest['summarized'] and not store.summaries_exist():
+            # Summaries were deleted; everything has to be redone
+            changed_weeks = set(manifest['summarized'])
+            manifest['summarized'] = {}
+        if changed_files or changed_weeks != set():
+            store.save_manifest(manifest, changed_files, changed_weeks)
+        summarized = manifest['summarized']
+        return {
+            week: sorted(file_hashes)
+            for week, file_hashes in weeks.items()
+            if summarized.get(week) != week_hash(file_hashes)
+        }
+
+
+def mark_week_summarized(directory, week, file_hashes):
+    # file_hashes are the hashes of the content actually sent for summarization,
+    # so an edit made while the week was in flight still leaves it dirty
+    store = get_store(directory)
+    with locks.get_lock(store.directory).write():
+        manifest = store.load_manifest()
+        if manifest['summarized'] is None:
+            manifest['summarized'] = {}
+        manifest['summarized'][week] = week_hash(file_hashes)
+        store.save_manifest(manifest, changed_files=set(), changed_weeks={week})
@@ -0,0 +1,229 @@
+import glob
+import json
+import math
+import os
+import threading
+import time
+
+# Upper bounds (seconds) for request and call latency histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Metrics are kept per process. With several workers (gunicorn.conf.py sets
+# this), each one also writes a snapshot of its metrics here every
+# LIFEOS_METRICS_INTERVAL seconds and when it exits, and /metrics sums the
+# snapshots of every worker that has run, so a scrape doesn't depend on which
+# worker answers and a restarted worker doesn't reset the counters. Other
+# workers' numbers can be up to one interval old. Unset, /metrics reports
+# only the process that answers.
+METRICS_DIR = os.environ.get('LIFEOS_METRICS_DIR')
+SNAPSHOT_INTERVAL = float(os.environ.get('LIFEOS_METRICS_INTERVAL', 5))
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (non-cumulative), sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self.values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            yield from histogram_samples(self.name, labels, zip(self.buckets, counts), total, count)
+
+
+def histogram_samples(name, labels, bucket_counts, total, count, cumulative=False):
+    # Prometheus buckets are cumulative and end with le="+Inf"
+    running = 0
+    for bound, bucket_count in bucket_counts:
+        running = bucket_count if cumulative else running + bucket_count
+        yield f'{name}_bucket', {**labels, 'le': format_value(float(bound))}, running
+    yield f'{name}_bucket', {**labels, 'le': '+Inf'}, count
+    yield f'{name}_sum', labels, total
+    yield f'{name}_count', labels, count
+
+
+class Registry:
+    # Metrics owned here, plus collectors that report state kept elsewhere
+    # (cache hit counters, upstream histograms) when /metrics is scraped.
+    # A collector returns [(name, kind, help, samples)].
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        self.collectors.append(collector)
+        return collector
+
+    def families(self):
+        # name -> (kind, help, samples) for this process. Several collectors
+        # can report into one family (one per cache, say).
+        families = [(metric.name, metric.kind, metric.help_text, metric.samples()) for metric in self.metrics]
+        for collector in self.collectors:
+            families.extend(collector())
+        merged = {}
+        for name, kind, help_text, samples in families:
+            merged.setdefault(name, (kind, help_text, []))[2].extend(samples)
+        return merged
+
+    def render(self):
+        # Prometheus text exposition format, version 0.0.4
+        if METRICS_DIR:
+            write_snapshot(self)
+            families = read_snapshots()
+        else:
+            families = self.families()
+        lines = []
+        # Each family gets a single HELP/TYPE header
+        for name, (kind, help_text, samples) in families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples:
+                lines.append(f'{sample_name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.histogram(
+    'lifeos_http_request_duration_seconds', 'Time to serve a request, including streamed bodies',
+    ('route', 'method', 'status'))
+llm_requests = registry.histogram(
+    'lifeos_llm_request_duration_seconds', 'Chat completion calls that missed the LLM cache', ('model',))
+llm_tokens = registry.counter(
+    'lifeos_llm_tokens_total', 'Tokens reported in the usage of uncached chat completions', ('model', 'type'))
+file_io_bytes = registry.counter(
+    'lifeos_file_io_bytes_total', 'Bytes read and written by notes and store files', ('op', 'kind'))
+
+
+_snapshot_lock = threading.Lock()
+# (pid, snapshot path) of this process, so a forked worker gets a file of its own
+_snapshot_file = (None, None)
+
+
+def write_snapshot(registry=registry):
+    global _snapshot_file
+    with _snapshot_lock:
+        if _snapshot_file[0] != os.getpid():
+            # Unique even when a restarted worker reuses a pid
+            _snapshot_file = (os.getpid(), os.path.join(METRICS_DIR, f'{os.getpid()}-{time.time_ns()}.json'))
+        path = _snapshot_file[1]
+        families = {name: [kind, help_text, list(samples)] for name, (kind, help_text, samples) in registry.families().items()}
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(families, f)
+        os.replace(tmp_path, path)
+
+
+def read_snapshots():
+    # Every worker's families with samples of the same name and labels summed;
+    # everything here is a counter or histogram, so sums are what Prometheus expects
+    merged = {}
+    for path in sorted(glob.glob(os.path.join(METRICS_DIR, '*.json'))):
+        try:
+            with open(path) as f:
+                families = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+        for name, (kind, help_text, samples) in families.items():
+            values = merged.setdefault(name, (kind, help_text, {}))[2]
+            for sample_name, labels, value in samples:
+                key = (sample_name, tuple(labels.items()))
+                values[key] = values.get(key, 0) + value
+    return {name: (kind, help_text, [(sample_name, dict(labels), value) for (sample_name, labels), value in values.items()])
+            for name, (kind, help_text, values) in merged.items()}
+
+
+def start_snapshots():
+    # Called in each worker once it has forked; a no-op without LIFEOS_METRICS_DIR
+    if not METRICS_DIR:
+        return
+
+    def run():
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            try:
+                write_snapshot()
+            except OSError as e:
+                print(f'Error writing metrics snapshot: {str(e)}')
+
+    threading.Thread(target=run, name='metrics-snapshots', daemon=True).start()
+
+
+def cache_collector(name, cache):
+    # Reports a cache's hits/misses attributes
+    def collect():
+        return [
+            ('lifeos_cache_hits_total', 'counter', 'Cache lookups answered from the cache',
+             [('lifeos_cache_hits_total', {'cache': name}, cache.hits)]),
+            ('lifeos_cache_misses_total', 'counter', 'Cache lookups that had to load or call through',
+             [('lifeos_cache_misses_total', {'cache': name}, cache.misses)]),
+        ]
+    return collect
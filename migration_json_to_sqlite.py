@@ -0,0 +1,40 @@
+import json
+import os
+import sys
+
+import locks
+from storage import ADVICE_FILENAME, MANIFEST_FILENAME, SUMMARIES_FILENAME, SQLiteStore
+
+def import_json_files(notes_dir='~/notes'):
+    # Copy weekly_summaries.json, notes_manifest.json and advice.json into a
+    # lifeos.db next to them. The JSON files are left in place as a backup;
+    # once lifeos.db exists the directory uses the SQLite store.
+    notes_dir = os.path.realpath(os.path.expanduser(notes_dir))
+    # Holds the store lock throughout, so no JSON write lands mid-copy
+    with locks.get_lock(notes_dir).write():
+        store = SQLiteStore(notes_dir)
+
+        summaries_path = os.path.join(notes_dir, SUMMARIES_FILENAME)
+        if os.path.exists(summaries_path):
+            with open(summaries_path, 'r') as f:
+                summaries = json.load(f)
+            for summary in summaries:
+                store.upsert_summary(summary)
+            print(f'Imported {len(summaries)} weekly summaries')
+
+        manifest_path = os.path.join(notes_dir, MANIFEST_FILENAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            store.save_manifest(manifest)
+            print(f'Imported manifest for {len(manifest["files"])} notes')
+
+        advice_path = os.path.join(notes_dir, ADVICE_FILENAME)
+        if os.path.exists(advice_path):
+            with open(advice_path, 'r') as f:
+                advice_list = json.load(f)
+            store.save_advice(advice_list)
+            print(f'Imported {len(advice_list)} pieces of advice')
+
+if __name__ == "__main__":
+    import_json_files(sys.argv[1] if len(sys.argv) > 1 else '~/notes')
@@ -0,0 +1,63 @@
+import os
+import re
+from datetime import date, timedelta
+from functools import lru_cache
+
+# Lookup tables for the tokens strptime's %b and %a accept (case-insensitive)
+MONTHS = {name: number for number, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)}
+WEEKDAYS = frozenset(('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'))
+
+# "Mon Nov 25 2024" and "Nov 25 2024": the same strings the original
+# strptime("%a %b %d %Y") / strptime("%b %d %Y") pair accepted, where a
+# space in the format matches any run of whitespace
+NAMED_PATTERN = re.compile(r'(?:([A-Za-z]{3})\s+)?([A-Za-z]{3})\s+(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])\s+(\d{4})')
+# "2024-11-25", optionally followed by a title: "2024-11-25 standup"
+ISO_PATTERN = re.compile(r'(\d{4})-(\d\d)-(\d\d)(?:[\sT_-].*)?')
+# Notes are plain text: no extension (the original layout) or one of these.
+# Anything else that looks like an extension is an attachment.
+NOTE_EXTENSIONS = frozenset(('.md', '.markdown', '.txt', '.text', '.org'))
+EXTENSION_PATTERN = re.compile(r'\.[A-Za-z][A-Za-z0-9]{0,9}')
+
+
+def is_note_filename(filename):
+    # False for 'attachments/2024-11-26 screenshot.png'; True for 'Nov 25 2024',
+    # '2024-11-25 standup.md' and '2024-11-25 v1.2 notes'
+    extension = os.path.splitext(os.path.basename(filename))[1]
+    return not EXTENSION_PATTERN.fullmatch(extension) or extension.lower() in NOTE_EXTENSIONS
+
+
+@lru_cache(maxsize=1 << 16)
+def parse_note_date(filename):
+    # The date a note is for, from its filename, or None. Notes may live in
+    # subdirectories; only the last path component is looked at, and only the
+    # part before its first '.'.
+    basename = os.path.basename(filename).split('.')[0]
+    match = NAMED_PATTERN.fullmatch(basename)
+    if match:
+        weekday, month, day, year = match.groups()
+        if weekday is not None and weekday.lower() not in WEEKDAYS:
+            return None
+        month = MONTHS.get(month.lower())
+        if month is None:
+            return None
+    else:
+        match = ISO_PATTERN.fullmatch(basename)
+        if not match:
+            return None
+        year, month, day = match.groups()
+        month = int(month)
+    try:
+        return date(int(year), month, int(day))
+    except ValueError:
+        # Out of range, e.g. Feb 30
+        return None
+
+
+@lru_cache(maxsize=1 << 16)
+def week_key_for_filename(filename):
+    # The Monday starting the note's week, as YYYY-MM-DD, or None
+    note_date = parse_note_date(filename)
+    if note_date is None:
+        return None
+    return (note_date - timedelta(days=note_date.weekday())).isoformat()
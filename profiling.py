@@ -0,0 +1,86 @@
+import contextvars
+import cProfile
+import os
+import pstats
+import threading
+import time
+
+# Requests sent with `X-Profile: 1` or ?profile=1, and summarization jobs
+# submitted with profile=1, are run under cProfile; the stats are printed and
+# dumped to LIFEOS_PROFILE_DIR for pstats/snakeviz
+PROFILE_DIR = os.path.expanduser(os.environ.get('LIFEOS_PROFILE_DIR', '~/.cache/lifeos/profiles'))
+
+# The Profile the current thread's work belongs to
+_current = contextvars.ContextVar('lifeos_profile', default=None)
+
+
+def _enable():
+    # A started profiler, or None if Python won't run another one here
+    # (3.12+ allows one per process, and that one already sees every thread)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+    return profiler
+
+
+class Profile:
+    # cProfile only sees the thread that enables it, so a profile covers the
+    # thread that started it plus every task handed to a pool through wrap():
+    # each task runs under a profiler of its own, and its stats are merged in
+    # when the profile finishes.
+    def __init__(self, name):
+        self.name = name
+        self.path = os.path.join(PROFILE_DIR, f'{name}-{time.time_ns()}.pstats')
+        self.profiler = None
+        self.task_stats = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        # False if profiling isn't possible right now (another profile holds it on 3.12+)
+        self.profiler = _enable()
+        _current.set(self if self.profiler else None)
+        return self.profiler is not None
+
+    def add(self, stats):
+        with self.lock:
+            self.task_stats.append(stats)
+
+    def finish(self, print_stats=True):
+        # Call on the thread that started it; tasks still running are left out
+        _current.set(None)
+        self.profiler.disable()
+        stats = pstats.Stats(self.profiler)
+        with self.lock:
+            for task_stats in self.task_stats:
+                stats.add(task_stats)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stats.dump_stats(self.path)
+        print(f'Profile of {self.name} written to {self.path}')
+        if print_stats:
+            stats.sort_stats('cumulative').print_stats(25)
+
+    def discard(self):
+        _current.set(None)
+        self.profiler.disable()
+
+
+def wrap(fn):
+    # fn, made to run under the current thread's profile when a pool calls it
+    # on another thread; fn itself when nothing is being profiled
+    profile = _current.get()
+    if profile is None:
+        return fn
+
+    def run(*args, **kwargs):
+        token = _current.set(profile)
+        profiler = _enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profile.add(pstats.Stats(profiler))
+            _current.reset(token)
+    return run
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import metrics
+
+
+class CachedFile:
+    def __init__(self, signature, body):
+        self.signature = signature
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.last_modified = datetime.fromtimestamp(signature[0] / 1e9, tz=timezone.utc)
+        self._entries = None
+        self._timestamps = None
+
+    def timestamp_index(self):
+        # For summary lists: (entries sorted by timestamp, their timestamps),
+        # parsed on first use so plain full-file requests never pay for it
+        if self._entries is None:
+            entries = sorted(json.loads(self.body), key=lambda x: x['timestamp'])
+            self._timestamps = [entry['timestamp'] for entry in entries]
+            self._entries = entries
+        return self._entries, self._timestamps
+
+
+class JSONDocumentCache:
+    # Compact serialized bytes of the JSON documents in a storage backend,
+    # revalidated against the store's cheap signature on every lookup. Least recently used entries are
+    # evicted once max_bytes is exceeded.
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, signature, load):
+        # signature is (modified time in ns, version); load() returns the parsed document
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry.signature == signature:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = CachedFile(signature, json.dumps(load(), separators=(',', ':')).encode('utf-8'))
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.total_bytes -= len(old.body)
+            if len(entry.body) <= self.max_bytes:
+                self.entries[key] = entry
+                self.total_bytes += len(entry.body)
+                while self.total_bytes > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.total_bytes -= len(evicted.body)
+        return entry
+
+    def get_document(self, store, kind):
+        # Raises FileNotFoundError if the store has no such document yet
+        return self.get((store.backend, store.directory, kind), store.signature(kind), lambda: store.load(kind))
+
+
+cache = JSONDocumentCache(int(os.environ.get('LIFEOS_RESPONSE_CACHE_BYTES', 64 * 1024 * 1024)))
+metrics.registry.register_collector(metrics.cache_collector('response', cache))
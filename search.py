@@ -0,0 +1,334 @@
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+
+import locks
+import tokens
+from lazy_imports import lazy_import
+from storage import get_store
+
+np = lazy_import('numpy')
+
+INDEX_DIRNAME = os.path.join('.lifeos', 'search')
+# Note chunks are kept small so a hit points at a specific passage
+NOTE_CHUNK_TOKENS = 200
+# Summary fields worth searching; 'context' repeats across weeks
+SUMMARY_FIELDS = ('overall_summary', 'ideas', 'dreams', 'life', 'gratitude', 'complaints', 'questions', 'answers')
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+# Default prompt budget for retrieved excerpts
+RETRIEVAL_TOKENS = int(os.environ.get('LIFEOS_RETRIEVAL_TOKENS', 1500))
+
+# resolved directory -> SearchIndex
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class HashingEmbedder:
+    # Offline embedder: signed feature hashing of word unigrams and bigrams
+    # with sublinear term frequency, L2-normalized
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f'hashing-{dim}'
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = WORD_PATTERN.findall(text.lower())
+            counts = {}
+            for term in words + [f'{a} {b}' for a, b in zip(words, words[1:])]:
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                h = zlib.crc32(term.encode('utf-8'))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                vectors[row, h % self.dim] += sign * (1.0 + math.log(count))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class OpenAIEmbedder:
+    def __init__(self, model='text-embedding-3-small', dim=1536):
+        self.model = model
+        self.dim = dim
+        self.name = f'openai:{model}'
+
+    def embed(self, texts):
+        import openai
+        vectors = []
+        for start in range(0, len(texts), 256):
+            response = openai.embeddings.create(model=self.model, input=texts[start:start + 256])
+            vectors.extend(item.embedding for item in response.data)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+def get_embedder():
+    # LIFEOS_EMBEDDER=openai embeds with the OpenAI API; the default works offline
+    if os.environ.get('LIFEOS_EMBEDDER') == 'openai':
+        return OpenAIEmbedder()
+    return HashingEmbedder()
+
+
+class SearchIndex:
+    # Rows of a float32 matrix appended to a vectors file and read back
+    # through a memory map, with an append-only ids.jsonl sidecar describing
+    # each row (and recording deleted rows). Replacing a week deletes its rows
+    # and appends new ones; compact() writes a new vectors file and swaps in
+    # an ids.jsonl pointing at it once most rows are dead. Writers hold the
+    # directory's search lock and loads its read lock, so workers never see
+    # each other's half-written appends. A load parses only the lines
+    # appended since the last one, unless the header changed (a compaction
+    # or rebuild), so indexing a week costs the week, not the history.
+    def __init__(self, directory, embedder):
+        self.directory = directory
+        self.embedder = embedder
+        self.index_dir = os.path.join(directory, INDEX_DIRNAME)
+        self.ids_path = os.path.join(self.index_dir, 'ids.jsonl')
+        self.lock = threading.RLock()
+        self.file_lock = locks.get_lock(directory, 'search')
+        self._clear()
+
+    def _clear(self):
+        self.vectors_path = None
+        # The header line of the ids.jsonl parsed, and how many bytes of it
+        self.header_line = None
+        self.ids_offset = 0
+        # One item per row, kept after the row is deleted; alive says which rows count
+        self.items = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.kinds = np.zeros(0, dtype=object)
+        # week -> its live rows
+        self.week_rows = {}
+        self.vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self.signature = None
+
+    def exists(self):
+        return os.path.exists(self.ids_path)
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.ids_path)
+        except FileNotFoundError:
+            return None
+        try:
+            vectors_size = os.path.getsize(self.vectors_path) if self.vectors_path else None
+        except FileNotFoundError:
+            # Another worker compacted the index into a new vectors file
+            vectors_size = None
+        return (st.st_mtime_ns, st.st_size, st.st_ino, vectors_size)
+
+    def load(self):
+        # Re-reads the files only if another writer changed them, and then
+        # only the lines appended since the last load if the header is the same
+        with self.lock, self.file_lock.read():
+            signature = self._file_signature()
+            if signature is None or signature == self.signature:
+                return
+            try:
+                with open(self.ids_path, 'rb') as f:
+                    header_line = f.readline()
+                    if header_line != self.header_line or signature[1] < self.ids_offset:
+                        header = json.loads(header_line)
+                        if header.get('embedder') != self.embedder.name:
+                            raise ValueError(f'Search index was built with {header.get("embedder")}, '
+                                             f'not {self.embedder.name}; rebuild it with python search.py')
+                        self._clear()
+                        self.vectors_path = os.path.join(self.index_dir, header['vectors'])
+                        self.header_line = header_line
+                        self.ids_offset = len(header_line)
+                    f.seek(self.ids_offset)
+                    first_new_row = len(self.items)
+                    deleted = []
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            break
+                        self.ids_offset += len(line)
+                        record = json.loads(line)
+                        if 'delete' in record:
+                            for row in record['delete']:
+                                if row < len(self.items):
+                                    deleted.append(row)
+                                    self.week_rows.get(self.items[row]['week'], set()).discard(row)
+                        else:
+                            self.week_rows.setdefault(record['week'], set()).add(len(self.items))
+                            self.items.append(record)
+                # New arrays rather than updates in place, so a search holding the old ones is unaffected
+                new_items = self.items[first_new_row:]
+                alive = np.concatenate((self.alive, np.ones(len(new_items), dtype=bool)))
+                alive[deleted] = False
+                self.alive = alive
+                self.kinds = np.concatenate((self.kinds, np.array([item['kind'] for item in new_items], dtype=object)))
+                # A crash between the two appends can leave extra vectors; ignore them
+                rows = min(len(self.items), os.path.getsize(self.vectors_path) // (4 * self.embedder.dim))
+                self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.embedder.dim)) \
+                    if rows else np.zeros((0, self.embedder.dim), dtype=np.float32)
+                self.signature = self._file_signature()
+            except BaseException:
+                # Start over next time rather than trust a half-parsed update
+                self._clear()
+                raise
+
+    def _rewrite(self, items, vectors):
+        # Writes a fresh vectors file, then atomically swaps in an ids.jsonl
+        # that points at it, so a crash leaves either the old or the new index
+        os.makedirs(self.index_dir, exist_ok=True)
+        vectors_name = f'vectors.{time.time_ns()}.f32'
+        with open(os.path.join(self.index_dir, vectors_name), 'wb') as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        tmp_ids = f'{self.ids_path}.tmp'
+        with open(tmp_ids, 'w') as f:
+            f.write(json.dumps({'embedder': self.embedder.name, 'dim': self.embedder.dim, 'vectors': vectors_name}) + '\n')
+            for item in items:
+                f.write(json.dumps(item) + '\n')
+        old_vectors = self.vectors_path
+        os.replace(tmp_ids, self.ids_path)
+        self.signature = None
+        self.load()
+        if old_vectors and old_vectors != self.vectors_path and os.path.exists(old_vectors):
+            os.remove(old_vectors)
+
+    def _reset(self):
+        self._rewrite([], np.zeros((0, self.embedder.dim), dtype=np.float32))
+
+    def _append(self, records, vectors, delete_rows):
+        if not self.exists():
+            self._reset()
+        self.load()
+        if records:
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.ids_path, 'a') as f:
+            if delete_rows:
+                f.write(json.dumps({'delete': delete_rows}) + '\n')
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        self.load()
+
+    def replace_week(self, week, records):
+        # records: [{'kind', 'week', 'ref', 'text'}] making up everything indexed for `week`.
+        # Embedding can mean API calls, so it happens before taking the locks.
+        vectors = self.embedder.embed([record['text'] for record in records]) if records else None
+        with self.lock, self.file_lock.write():
+            if self.exists():
+                self.load()
+            delete_rows = sorted(self.week_rows.get(week, ()))
+            self._append(records, vectors, delete_rows)
+            if len(self.items) > 1000 and self.alive.sum() < len(self.items) / 2:
+                self.compact()
+
+    def reset(self):
+        with self.lock, self.file_lock.write():
+            self._reset()
+
+    def compact(self):
+        with self.lock, self.file_lock.write():
+            self.load()
+            rows = np.flatnonzero(self.alive[:len(self.vectors)])
+            self._rewrite([self.items[row] for row in rows], np.array(self.vectors[rows], dtype=np.float32))
+
+    def search(self, query, k=10, kinds=None):
+        with self.lock:
+            self.load()
+            vectors, items = self.vectors, self.items
+            alive, item_kinds = self.alive[:len(vectors)], self.kinds[:len(vectors)]
+        if not len(vectors):
+            return []
+        scores = vectors @ self.embedder.embed([query])[0]
+        mask = alive
+        if kinds:
+            mask = mask & np.isin(item_kinds, list(kinds))
+        scores = np.where(mask, scores, -np.inf)
+        k = min(k, int(mask.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [dict(items[row], score=float(scores[row])) for row in top]
+
+
+def get_index(directory):
+    directory = os.path.realpath(os.path.expanduser(directory))
+    with _indexes_lock:
+        index = _indexes.get(directory)
+        if index is None:
+            index = _indexes[directory] = SearchIndex(directory, get_embedder())
+    return index
+
+
+def week_records(entry, notes):
+    # Rows for one week: each non-empty summary field, and each note split into
+    # small chunks. notes maps filename -> text.
+    week = entry['week']
+    records = []
+    for field in SUMMARY_FIELDS:
+        text = entry.get('summary', {}).get(field)
+        if isinstance(text, str) and text.strip():
+            records.append({'kind': 'summary', 'week': week, 'ref': field, 'text': text})
+    for filename, text in notes.items():
+        for i, chunk in enumerate(tokens.split_text(text, NOTE_CHUNK_TOKENS)):
+            if chunk.strip():
+                records.append({'kind': 'note', 'week': week, 'ref': filename, 'chunk': i, 'text': chunk})
+    return records
+
+
+def index_week(directory, entry, notes):
+    get_index(directory).replace_week(entry['week'], week_records(entry, notes))
+
+
+def retrieve_context(directory, query, token_budget=None, k=20, kinds=None):
+    # The most relevant summary fields and note excerpts for `query`, best
+    # first, formatted for a prompt and kept under token_budget tokens. Empty
+    # if the directory has no search index yet.
+    token_budget = RETRIEVAL_TOKENS if token_budget is None else token_budget
+    index = get_index(directory)
+    if not query or token_budget <= 0 or not index.exists():
+        return ''
+    try:
+        hits = index.search(query, k, kinds)
+    except (ValueError, locks.LockTimeout) as e:
+        print(f'Skipping retrieval: {str(e)}')
+        return ''
+    sections = []
+    used = 0
+    for hit in hits:
+        if hit['text'].strip() == query.strip():
+            continue
+        source = f'summary: {hit["ref"]}' if hit['kind'] == 'summary' else f'note: {hit["ref"]}'
+        section = f'[Week of {hit["week"]}, {source}]\n{hit["text"].strip()}\n\n'
+        section_tokens = tokens.count_tokens(section)
+        if used + section_tokens > token_budget:
+            continue
+        sections.append(section)
+        used += section_tokens
+    return ''.join(sections).strip()
+
+
+def build_index(directory):
+    # Full (re)build from the stored summaries and the notes on disk
+    store = get_store(directory)
+    index = get_index(directory)
+    # Locked week by week rather than throughout, so searches keep working
+    # (against a partial index) while it rebuilds
+    index.reset()
+    for entry in store.load_summaries():
+        notes = {}
+        for filename in entry.get('files', []):
+            try:
+                with open(os.path.join(store.directory, filename), 'r', encoding='utf-8') as f:
+                    notes[filename] = f.read()
+            except (FileNotFoundError, UnicodeDecodeError):
+                continue
+        index.replace_week(entry['week'], week_records(entry, notes))
+        print(f'Indexed week {entry["week"]}')
+    return index
+
+
+if __name__ == "__main__":
+    build_index(sys.argv[1] if len(sys.argv) > 1 else '~/notes')
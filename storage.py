@@ -0,0 +1,324 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import locks
+import metrics
+
+SUMMARIES_FILENAME = 'weekly_summaries.json'
+ADVICE_FILENAME = 'advice.json'
+MANIFEST_FILENAME = 'notes_manifest.json'
+DATABASE_FILENAME = 'lifeos.db'
+# Files the stores keep in the notes directory; never treated as notes
+RESERVED_FILENAMES = {
+    SUMMARIES_FILENAME, ADVICE_FILENAME, MANIFEST_FILENAME,
+    DATABASE_FILENAME, f'{DATABASE_FILENAME}-wal', f'{DATABASE_FILENAME}-shm', f'{DATABASE_FILENAME}-journal',
+}
+
+# (backend, resolved directory) -> store
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def atomic_write(path, data, kind='store'):
+    return atomic_write_chunks(path, [data], kind)
+
+
+def atomic_write_chunks(path, chunks, kind='store'):
+    # Write to a hidden temp file next to `path` and rename it into place, so
+    # readers (and a crash) only ever see the old or the new contents.
+    # chunks is any iterable of bytes, e.g. a streamed request body; kind
+    # labels the bytes in the file I/O metrics. A symlink is written through:
+    # the file it points to is replaced, not the link itself.
+    directory, filename = os.path.split(os.path.realpath(path))
+    path = os.path.join(directory, filename)
+    tmp_path = os.path.join(directory, f'.{filename}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        size = 0
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        # Keep the permissions of the file being replaced
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+        metrics.file_io_bytes.inc(size, op='write', kind=kind)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size
+
+
+def atomic_write_json(path, data, indent=None):
+    atomic_write(path, json.dumps(data, indent=indent).encode('utf-8'))
+
+
+def empty_manifest():
+    # 'summarized' is None until bootstrapped from the existing summaries
+    return {'files': {}, 'summarized': None}
+
+
+class JSONStore:
+    # The original layout: weekly_summaries.json, advice.json and
+    # notes_manifest.json in the notes directory, each rewritten whole.
+    # Writes hold the directory's store lock, so read-modify-writes from
+    # several workers don't lose each other's updates; reads take no lock,
+    # since every file is replaced atomically.
+    backend = 'json'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.paths = {
+            'summaries': os.path.join(directory, SUMMARIES_FILENAME),
+            'advice': os.path.join(directory, ADVICE_FILENAME),
+        }
+        self.manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+        # Filenames whose change means the summaries changed, for the watcher
+        self.summaries_watch_names = {SUMMARIES_FILENAME}
+        self._manifest = None
+        self._lock = locks.get_lock(directory)
+
+    def signature(self, kind):
+        # Cheap change token for a document; raises FileNotFoundError if it doesn't exist.
+        # Every write is a new inode, which tells apart two same-sized writes
+        # landing within one mtime tick.
+        st = os.stat(self.paths[kind])
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def load(self, kind):
+        with open(self.paths[kind], 'rb') as f:
+            data = f.read()
+        metrics.file_io_bytes.inc(len(data), op='read', kind='store')
+        return json.loads(data)
+
+    def load_summaries(self):
+        try:
+            return self.load('summaries')
+        except FileNotFoundError:
+            return []
+
+    def latest_summary(self):
+        summaries = self.load_summaries()
+        return max(summaries, key=lambda x: x['timestamp']) if summaries else None
+
+    def summaries_exist(self):
+        return os.path.exists(self.paths['summaries'])
+
+    def upsert_summary(self, entry):
+        with self._lock.write():
+            summaries = [s for s in self.load_summaries() if s['week'] != entry['week']]
+            summaries.append(entry)
+            summaries.sort(key=lambda x: x['timestamp'])
+            atomic_write_json(self.paths['summaries'], summaries, indent=4)
+
+    def load_advice(self):
+        return self.load('advice')
+
+    def save_advice(self, advice_list):
+        with self._lock.write():
+            atomic_write_json(self.paths['advice'], advice_list, indent=4)
+
+    def load_manifest(self):
+        try:
+            st = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return empty_manifest()
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        # Keep the parsed manifest while the file is unchanged, so polling doesn't re-parse it
+        if self._manifest and self._manifest[0] == signature:
+            return self._manifest[1]
+        with open(self.manifest_path, 'rb') as f:
+            data = f.read()
+        metrics.file_io_bytes.inc(len(data), op='read', kind='store')
+        manifest = json.loads(data)
+        self._manifest = (signature, manifest)
+        return manifest
+
+    def save_manifest(self, manifest, changed_files=None, changed_weeks=None):
+        # The JSON manifest is always rewritten whole; the change hints are for SQLite
+        with self._lock.write():
+            atomic_write_json(self.manifest_path, manifest)
+            st = os.stat(self.manifest_path)
+            self._manifest = ((st.st_mtime_ns, st.st_size, st.st_ino), manifest)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS summaries (
+    week TEXT PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS summaries_timestamp ON summaries (timestamp);
+CREATE TABLE IF NOT EXISTS advice (
+    position INTEGER PRIMARY KEY,
+    entry TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS manifest_files (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT,
+    week TEXT
+);
+CREATE INDEX IF NOT EXISTS manifest_files_week ON manifest_files (week);
+CREATE TABLE IF NOT EXISTS manifest_weeks (
+    week TEXT PRIMARY KEY,
+    hash TEXT NOT NULL
+);
+-- One row per document kind, bumped in the same transaction as every write
+CREATE TABLE IF NOT EXISTS revisions (
+    kind TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL,
+    updated_ns INTEGER NOT NULL
+);
+"""
+
+
+class SQLiteStore:
+    # Everything in a single WAL-mode lifeos.db in the notes directory;
+    # writing one week is a single-row upsert.
+    backend = 'sqlite'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, DATABASE_FILENAME)
+        self.summaries_watch_names = {DATABASE_FILENAME, f'{DATABASE_FILENAME}-wal'}
+        self._lock = threading.RLock()
+        self._manifest = None
+        self._db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    def _write(self, kinds, statements):
+        # Runs `statements(cursor)` in one transaction and bumps the revision of each kind
+        with self._lock:
+            cursor = self._db.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                statements(cursor)
+                now = time.time_ns()
+                for kind in kinds:
+                    cursor.execute(
+                        'INSERT INTO revisions (kind, revision, updated_ns) VALUES (?, 1, ?) '
+                        'ON CONFLICT (kind) DO UPDATE SET revision = revision + 1, updated_ns = excluded.updated_ns',
+                        (kind, now))
+                cursor.execute('COMMIT')
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def signature(self, kind):
+        rows = self._query('SELECT updated_ns, revision FROM revisions WHERE kind = ?', (kind,))
+        if not rows:
+            raise FileNotFoundError(f'No {kind} in {self.path}')
+        return rows[0]
+
+    def load(self, kind):
+        if kind == 'summaries':
+            return self.load_summaries()
+        return self.load_advice()
+
+    def load_summaries(self):
+        return [json.loads(entry) for (entry,) in self._query('SELECT entry FROM summaries ORDER BY timestamp')]
+
+    def latest_summary(self):
+        rows = self._query('SELECT entry FROM summaries ORDER BY timestamp DESC LIMIT 1')
+        return json.loads(rows[0][0]) if rows else None
+
+    def summaries_exist(self):
+        return bool(self._query('SELECT 1 FROM summaries LIMIT 1'))
+
+    def upsert_summary(self, entry):
+        self._write(['summaries'], lambda cursor: cursor.execute(
+            'INSERT INTO summaries (week, timestamp, entry) VALUES (?, ?, ?) '
+            'ON CONFLICT (week) DO UPDATE SET timestamp = excluded.timestamp, entry = excluded.entry',
+            (entry['week'], entry['timestamp'], json.dumps(entry))))
+
+    def load_advice(self):
+        rows = self._query('SELECT entry FROM advice ORDER BY position')
+        if not rows and not self._query("SELECT 1 FROM revisions WHERE kind = 'advice'"):
+            raise FileNotFoundError(f'No advice in {self.path}')
+        return [json.loads(entry) for (entry,) in rows]
+
+    def save_advice(self, advice_list):
+        def statements(cursor):
+            cursor.execute('DELETE FROM advice')
+            cursor.executemany('INSERT INTO advice (position, entry) VALUES (?, ?)',
+                               [(i, json.dumps(advice)) for i, advice in enumerate(advice_list)])
+        self._write(['advice'], statements)
+
+    def load_manifest(self):
+        rows = self._query("SELECT revision FROM revisions WHERE kind = 'manifest'")
+        if not rows:
+            return empty_manifest()
+        if self._manifest and self._manifest[0] == rows[0][0]:
+            return self._manifest[1]
+        files = {
+            name: {'mtime_ns': mtime_ns, 'size': size, 'hash': file_hash, 'week': week}
+            for name, mtime_ns, size, file_hash, week in self._query(
+                'SELECT name, mtime_ns, size, hash, week FROM manifest_files')
+        }
+        summarized = dict(self._query('SELECT week, hash FROM manifest_weeks'))
+        manifest = {'files': files, 'summarized': summarized}
+        self._manifest = (rows[0][0], manifest)
+        return manifest
+
+    def save_manifest(self, manifest, changed_files=None, changed_weeks=None):
+        # Only the named files and weeks are written; None means all of them
+        files = manifest['files']
+        summarized = manifest['summarized'] or {}
+        file_names = files.keys() if changed_files is None else changed_files
+        weeks = summarized.keys() if changed_weeks is None else changed_weeks
+
+        def statements(cursor):
+            if changed_files is None:
+                cursor.execute('DELETE FROM manifest_files')
+            if changed_weeks is None:
+                cursor.execute('DELETE FROM manifest_weeks')
+            for name in file_names:
+                record = files.get(name)
+                if record is None:
+                    cursor.execute('DELETE FROM manifest_files WHERE name = ?', (name,))
+                else:
+                    cursor.execute(
+                        'INSERT OR REPLACE INTO manifest_files (name, mtime_ns, size, hash, week) VALUES (?, ?, ?, ?, ?)',
+                        (name, record['mtime_ns'], record['size'], record['hash'], record['week']))
+            for week in weeks:
+                if week in summarized:
+                    cursor.execute('INSERT OR REPLACE INTO manifest_weeks (week, hash) VALUES (?, ?)',
+                                   (week, summarized[week]))
+                else:
+                    cursor.execute('DELETE FROM manifest_weeks WHERE week = ?', (week,))
+        with self._lock:
+            self._write(['manifest'], statements)
+            self._manifest = (self.signature('manifest')[1], manifest)
+
+
+def get_store(directory):
+    # LIFEOS_STORAGE=json|sqlite picks the backend; by default a directory
+    # uses SQLite once it has a lifeos.db (see migration_json_to_sqlite.py)
+    directory = os.path.realpath(os.path.expanduser(directory))
+    backend = os.environ.get('LIFEOS_STORAGE')
+    if not backend:
+        backend = 'sqlite' if os.path.exists(os.path.join(directory, DATABASE_FILENAME)) else 'json'
+    key = (backend, directory)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = _stores[key] = SQLiteStore(directory) if backend == 'sqlite' else JSONStore(directory)
+    return store
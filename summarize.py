@@ -1,40 +1,77 @@
 import json
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
 from collections import defaultdict
-import openai
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import time
 
+import llm_cache
+import locks
+import manifest
+import metrics
+import profiling
+import note_dates
+import search
+import tokens
+import trends
+from lazy_imports import lazy_import
+from storage import get_store
+
+# Loaded on first use; importing the SDK takes most of a second
+openai = lazy_import('openai')
+
 def group_files_by_week(directory):
     files_by_week = defaultdict(list)
-    for filename in os.listdir(directory):
-        if os.path.isfile(os.path.join(directory, filename)):
-            try:
-                # Try parsing the date from the filename with and without day of the week
-                try:
-                    file_date = datetime.strptime(filename.split('.')[0], "%a %b %d %Y")
-                except ValueError:
-                    try:
-                        file_date = datetime.strptime(filename.split('.')[0], "%b %d %Y")
-                    except ValueError:
-                        raise ValueError(f"Unable to parse date from filename: {filename}")
-                
-                # Calculate the start of the week (Monday)
-                start_of_week = file_date - timedelta(days=file_date.weekday())
-                # Use the start of the week as the key
-                week_key = start_of_week.strftime("%Y-%m-%d")
-                # Add the filename to the appropriate week
-                files_by_week[week_key].append(filename)
-            except ValueError as e:
-                print(f'Error processing file {filename}: {str(e)}')
-                # Skip files that don't match the expected date format
-                continue
+    # Filenames are relative paths, so notes can be kept in subdirectories
+    for filename, _ in manifest.iter_note_entries(directory):
+        week_key = note_dates.week_key_for_filename(filename)
+        if week_key is None:
+            # Skip files that don't match the expected date format
+            print(f'Error processing file {filename}: Unable to parse date from filename: {filename}')
+            continue
+        # Add the filename to the appropriate week
+        files_by_week[week_key].append(filename)
     return dict(files_by_week)
 
 
-def summarize_weekly_notes(all_text_in_week, context):
+CONTEXT_DESCRIPTION = """A new summary of the author's overall life, based on the context given in the prompt. 
+                            Begin with the old context given in the prompt, and ONLY change it if the author's life has changed significantly. 
+                            Remove information if it's no longer relevant, or add information if something significant has happened in the author's life. 
+                            If the summary begins to get too long (say, longer than 7 sentences), summarize it down, or remove information that's no longer relevant."""
+
+
+# Weeks whose notes and context would make a prompt over MAX_PROMPT_TOKENS are
+# summarized in chunks of at most CHUNK_TOKENS (CHUNK_CONCURRENCY at a time),
+# and the chunk summaries are then reduced with generate_summary
+MAX_PROMPT_TOKENS = int(os.environ.get('LIFEOS_MAX_PROMPT_TOKENS', 6000))
+CHUNK_TOKENS = int(os.environ.get('LIFEOS_CHUNK_TOKENS', 3000))
+CHUNK_CONCURRENCY = int(os.environ.get('LIFEOS_CHUNK_CONCURRENCY', 4))
+
+
+class RateLimiter:
+    # Spaces out call starts so that at most `requests_per_minute` begin per minute.
+    # Shared between worker threads; a falsy limit disables it.
+    def __init__(self, requests_per_minute=None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0, slot - now))
+
+
+def summarize_weekly_notes(all_text_in_week, context, use_cache=True):
     print('summarizing')
-    response = openai.chat.completions.create(
+    response = llm_cache.chat_completion(
+        openai,
+        use_cache=use_cache,
         model='gpt-4',
         messages=[
             {"role": "system", "content": "You are a helpful assistant."},
@@ -89,10 +126,7 @@ Here are the weekly notes:
                         },
                         "context":{
                             "type":"string",
-                                "description":"""A new summary of the author's overall life, based on the context given in the prompt. 
-                            Begin with the old context given in the prompt, and ONLY change it if the author's life has changed significantly. 
-                            Remove information if it's no longer relevant, or add information if something significant has happened in the author's life. 
-                            If the summary begins to get too long (say, longer than 7 sentences), summarize it down, or remove information that's no longer relevant."""
+                            "description": CONTEXT_DESCRIPTION
                         }
                     },
                     "required": ["key_points", "main_themes", "overall_summary"]
@@ -105,82 +139,244 @@ Here are the weekly notes:
     print('summarized')
 
     # Extract the summary from the response
-    function_response = json.loads(response.choices[0].message.function_call.arguments)
+    function_response = json.loads(response['choices'][0]['message']['function_call']['arguments'])
     return function_response
 
 
-def get_unsummarized_weeks(directory, output_file):
+def summarize_notes_chunk(text, use_cache=True):
+    # Map step for oversized weeks: a plain-text summary of part of the week
+    response = llm_cache.chat_completion(
+        openai,
+        use_cache=use_cache,
+        model='gpt-4',
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": f"""The following is part of a week of notes. Summarize it in detail, in the second person, in the past tense.
+Keep any ideas, dreams, life events, things the author is grateful for, complaints and open questions, since this summary will be combined with the rest of the week.
+You can ignore TODOs and other transient content.
+
+{text}"""}
+        ],
+        temperature=0.5
+    )
+    return response['choices'][0]['message']['content']
+
+
+def summarize_week(notes, context, rate_limiter=None, max_prompt_tokens=None, chunk_tokens=None, use_cache=True):
+    # Summarizes one week's notes (one section per file), reducing them through
+    # rounds of parallel chunk summaries first if they don't fit in one prompt.
+    # Returns the generate_summary result and the week's token counts.
+    rate_limiter = rate_limiter or RateLimiter()
+    max_prompt_tokens = max_prompt_tokens or MAX_PROMPT_TOKENS
+    chunk_tokens = chunk_tokens or CHUNK_TOKENS
+    context_tokens = tokens.count_tokens(context)
+    note_tokens = sum(tokens.count_tokens(note) for note in notes)
+    report = {'note_tokens': note_tokens, 'context_tokens': context_tokens, 'chunks': 0, 'rounds': 0}
+
+    sections = notes
+    section_tokens = note_tokens
+    while section_tokens + context_tokens > max_prompt_tokens:
+        chunks = tokens.chunk_sections(sections, chunk_tokens)
+        print(f'summarizing {len(chunks)} chunks ({section_tokens} tokens)')
+
+        def summarize_chunk(chunk):
+            rate_limiter.wait()
+            return summarize_notes_chunk(chunk, use_cache)
+
+        with ThreadPoolExecutor(max_workers=CHUNK_CONCURRENCY) as executor:
+            chunk_summaries = list(executor.map(profiling.wrap(summarize_chunk), chunks))
+        reduced = [f'#### Part {i + 1}\n\n{summary}\n\n' for i, summary in enumerate(chunk_summaries)]
+        reduced_tokens = sum(tokens.count_tokens(section) for section in reduced)
+        report['chunks'] += len(chunks)
+        report['rounds'] += 1
+        if reduced_tokens >= section_tokens:
+            # Summaries aren't getting any shorter; send what we have
+            break
+        sections, section_tokens = reduced, reduced_tokens
+
+    report['prompt_tokens'] = section_tokens + context_tokens
+    rate_limiter.wait()
+    return summarize_weekly_notes(''.join(sections), context, use_cache), report
+
+
+def update_context(context, weekly_summary, use_cache=True):
+    # Cheap follow-up call used by the pipelined mode: the week was summarized
+    # against a stale context, so roll the context forward from the summary alone.
+    response = llm_cache.chat_completion(
+        openai,
+        use_cache=use_cache,
+        model='gpt-4',
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": f"""Here is some context about the author's life:
+
+{context}
+
+Here is a summary of the author's most recent week:
+
+{weekly_summary.get('overall_summary', '')}
+
+{weekly_summary.get('life', '')}"""}
+        ],
+        functions=[
+            {
+                "name": "update_context",
+                "description": "Update the context about the author's life if it has changed this week.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "context": {
+                            "type": "string",
+                            "description": CONTEXT_DESCRIPTION
+                        }
+                    },
+                    "required": ["context"]
+                }
+            }
+        ],
+        function_call={"name": "update_context"},
+        temperature=0.5
+    )
+    return json.loads(response['choices'][0]['message']['function_call']['arguments'])['context']
+
+
+def get_unsummarized_weeks(directory):
+    # Weeks are dirty when their notes' content (or names) changed since they
+    # were last summarized, tracked in the notes manifest next to the summaries
     expanded_dir = os.path.expanduser(directory)
-    all_weeks = group_files_by_week(expanded_dir)
-    
+    return manifest.get_dirty_weeks(expanded_dir)
+
+def read_week_notes(expanded_dir, files):
+    # Returns one section of text per note, along with the hash of each file as it was read.
+    # A note that isn't UTF-8 text is left out rather than failing the run; its
+    # hash is still recorded, so the week isn't retried until the file changes.
+    notes = []
+    file_hashes = {}
+    for file in files:
+        with open(os.path.join(expanded_dir, file), 'rb') as f:
+            data = f.read()
+        metrics.file_io_bytes.inc(len(data), op='read', kind='notes')
+        file_hashes[file] = manifest.hash_bytes(data)
+        try:
+            notes.append(f'#### {file}\n\n' + data.decode('utf-8'))
+        except UnicodeDecodeError as e:
+            print(f'Skipping {file}: not UTF-8 text ({str(e)})')
+    return notes, file_hashes
+
+
+def commit_week_summary(store, week, files, notes, weekly_summary, file_hashes, token_report):
+    # Write each summary as soon as it's generated, so an interrupted run
+    # picks up from the last committed week
+    entry = {
+        'week': week,
+        'timestamp': datetime.strptime(week, "%Y-%m-%d").timestamp(),
+        'summary': weekly_summary,
+        'files': files,
+        'tokens': token_report
+    }
+    store.upsert_summary(entry)
+    manifest.mark_week_summarized(store.directory, week, file_hashes)
+    # Notes sections start with the '#### filename' header read_week_notes added
+    # (skipped notes have no section, so this can't zip them against files)
+    note_texts = dict(note[len('#### '):].split('\n\n', 1) for note in notes)
+    # Both indexes can always be rebuilt (`python search.py`, `python trends.py`);
+    # don't lose the summary over them
     try:
-        with open(output_file, 'r') as f:
-            summaries = json.load(f)
-        # Create a dict mapping weeks to their files from existing summaries
-        existing_weeks = {summary['week']: set(summary.get('files', [])) for summary in summaries}
-        # Check both if week is new or if files have changed
-        unsummarized_weeks = {
-            week: files 
-            for week, files in all_weeks.items() 
-            if week not in existing_weeks or len(files) != len(existing_weeks[week])
-        }
-    except FileNotFoundError:
-        unsummarized_weeks = all_weeks
-    
-    return unsummarized_weeks
+        search.index_week(store.directory, entry, note_texts)
+    except Exception as e:
+        print(f'Error indexing week {week} for search: {str(e)}')
+    try:
+        trends.index_week(store.directory, entry, note_texts)
+    except Exception as e:
+        print(f'Error counting week {week} for trends: {str(e)}')
+    print(f'Updated summary for week {week} written to {store.directory} ({store.backend}), '
+          f'{token_report["prompt_tokens"]} prompt tokens from {token_report["note_tokens"]} note tokens')
+
 
-def summarize_new_notes(directory):
+def summarize_new_notes(directory, concurrency=1, requests_per_minute=None, use_cache=True, progress=None,
+                        should_cancel=None):
+    # use_cache=False forces fresh completions instead of reusing ones cached by an earlier run.
+    # progress(week, weeks_done, weeks_total) is called once up front (week None)
+    # and after each committed week; should_cancel() is checked before each
+    # week and stops the run early, leaving the committed weeks in place.
     expanded_dir = os.path.expanduser(directory)
-    output_file = os.path.join(os.path.dirname(__file__), f'{expanded_dir}/weekly_summaries.json')
+    store = get_store(expanded_dir)
     
-    unsummarized_weeks = get_unsummarized_weeks(expanded_dir, output_file)
+    # One run per directory at a time, across workers: a second run would pay
+    # for the same weeks again. Raises locks.LockTimeout if one is going.
+    with locks.get_lock(store.directory, 'summarize').write(timeout=0):
+        unsummarized_weeks = get_unsummarized_weeks(expanded_dir)
     
-    if not unsummarized_weeks:
-        print("No new weeks to summarize.")
-        return
+        if not unsummarized_weeks:
+            print("No new weeks to summarize.")
+            if progress:
+                progress(None, 0, 0)
+            return
     
-    try:
-        with open(output_file, 'r') as f:
-            summaries = json.load(f)
-        context = summaries[-1]['summary']['context'] if summaries else ''
-    except FileNotFoundError:
-        summaries = []
-        context = ''
+        latest_summary = store.latest_summary()
+        context = latest_summary['summary']['context'] if latest_summary else ''
     
-    sorted_weeks = sorted(unsummarized_weeks.items(), key=lambda x: datetime.strptime(x[0], "%Y-%m-%d"))
+        sorted_weeks = sorted(unsummarized_weeks.items(), key=lambda x: datetime.strptime(x[0], "%Y-%m-%d"))
+        if progress:
+            progress(None, 0, len(sorted_weeks))
     
-    for week, files in sorted_weeks:
-        timestamp = datetime.strptime(week, "%Y-%m-%d").timestamp()
-        all_text_in_week = ''
-        print('processing week', week)
-        for file in files:
-            with open(os.path.join(expanded_dir, file), 'r') as f:
-                all_text_in_week += f'#### {file}\n\n' + f.read()
-        
-        weekly_summary = summarize_weekly_notes(all_text_in_week, context)
-        context = weekly_summary['context']
-        # Check if a summary for this week already exists
-        existing_summary_index = next((i for i, s in enumerate(summaries) if s['week'] == week), None)
-        new_entry = {
-            'week': week,
-            'timestamp': timestamp,
-            'summary': weekly_summary,
-            'files': files
-        }
-        if existing_summary_index is not None:
-            # Update existing summary
-            summaries[existing_summary_index] = new_entry
+        if concurrency <= 1:
+            rate_limiter = RateLimiter(requests_per_minute)
+            for done, (week, files) in enumerate(sorted_weeks, 1):
+                if should_cancel and should_cancel():
+                    print(f'Cancelled with {len(sorted_weeks) - done + 1} weeks left')
+                    return
+                print('processing week', week)
+                notes, file_hashes = read_week_notes(expanded_dir, files)
+                weekly_summary, token_report = summarize_week(notes, context, rate_limiter, use_cache=use_cache)
+                context = weekly_summary['context']
+                commit_week_summary(store, week, files, notes, weekly_summary, file_hashes, token_report)
+                if progress:
+                    progress(week, done, len(sorted_weeks))
         else:
-            # Append new summary
-            summaries.append(new_entry)
-                
-        # Write to the output file after each summary is generated
-        summaries.sort(key=lambda x: x['timestamp'])
-        with open(output_file, 'w') as f:
-            json.dump(summaries, f, indent=4)
-        print(f'Updated summary for week {week} written to {output_file}')
+            if not summarize_weeks_pipelined(store, context, sorted_weeks, concurrency, requests_per_minute, use_cache,
+                                             progress, should_cancel):
+                return
     
-    print(f'All summaries written to {output_file}')
+        print(f'All summaries written to {store.directory}')
+
+
+def summarize_weeks_pipelined(store, context, sorted_weeks, concurrency, requests_per_minute=None, use_cache=True,
+                              progress=None, should_cancel=None):
+    # The expensive per-week calls run on a bounded pool against the context
+    # we started with; the context hand-off is then replayed sequentially with
+    # update_context as each week is committed. Weeks are committed strictly in
+    # timestamp order, so a crash leaves a contiguous prefix that the next run
+    # skips via get_unsummarized_weeks. Returns False if cancelled.
+    rate_limiter = RateLimiter(requests_per_minute)
+    base_context = context
+
+    def process_week(week, files):
+        print('processing week', week)
+        notes, file_hashes = read_week_notes(store.directory, files)
+        weekly_summary, token_report = summarize_week(notes, base_context, rate_limiter, use_cache=use_cache)
+        return notes, weekly_summary, file_hashes, token_report
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        futures = [executor.submit(profiling.wrap(process_week), week, files) for week, files in sorted_weeks]
+        for done, ((week, files), future) in enumerate(zip(sorted_weeks, futures), 1):
+            if should_cancel and should_cancel():
+                # Weeks already in flight still finish; their completions stay
+                # in the LLM cache, so resuming later doesn't pay for them again
+                print(f'Cancelled with {len(sorted_weeks) - done + 1} weeks left')
+                return False
+            notes, weekly_summary, file_hashes, token_report = future.result()
+            rate_limiter.wait()
+            context = update_context(context, weekly_summary, use_cache)
+            weekly_summary['context'] = context
+            commit_week_summary(store, week, files, notes, weekly_summary, file_hashes, token_report)
+            if progress:
+                progress(week, done, len(sorted_weeks))
+    finally:
+        # Don't start weeks we can no longer commit in order
+        executor.shutdown(wait=True, cancel_futures=True)
+    return True
 
 if __name__ == "__main__":
-    summarize_new_notes('~/notes')
+    summarize_new_notes('~/notes', concurrency=int(os.environ.get('SUMMARIZE_CONCURRENCY', 1)))
@@ -0,0 +1,87 @@
+from lazy_imports import lazy_import
+
+# None if tiktoken isn't installed; loaded the first time tokens are counted
+tiktoken = lazy_import('tiktoken')
+
+# Rough English average, used when tiktoken isn't available
+CHARS_PER_TOKEN = 4
+
+_encodings = {}
+
+
+def _encoding(model):
+    # None when tiktoken isn't installed or can't load its vocabulary (it
+    # downloads it on first use); callers fall back to CHARS_PER_TOKEN
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding('cl100k_base')
+        except Exception as e:
+            print(f'Falling back to estimated token counts: {str(e)}')
+            _encodings[model] = None
+    return _encodings[model]
+
+
+def count_tokens(text, model='gpt-4'):
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_text(text, max_tokens, model='gpt-4'):
+    # Hard split for a single section that is bigger than a chunk on its own:
+    # by paragraph where possible, by token (or character) count otherwise
+    pieces = []
+    current = ''
+    for paragraph in text.split('\n\n'):
+        candidate = f'{current}\n\n{paragraph}' if current else paragraph
+        if count_tokens(candidate, model) <= max_tokens:
+            current = candidate
+            continue
+        if count_tokens(paragraph, model) <= max_tokens:
+            pieces.append(current)
+            current = paragraph
+            continue
+        # The paragraph alone is too big: cut it (with anything pending) into
+        # max_tokens slices, and keep the tail open for what follows
+        encoding = _encoding(model)
+        if encoding is None:
+            step = max_tokens * CHARS_PER_TOKEN
+            slices = [candidate[i:i + step] for i in range(0, len(candidate), step)]
+        else:
+            encoded = encoding.encode(candidate, disallowed_special=())
+            slices = [encoding.decode(encoded[i:i + max_tokens]) for i in range(0, len(encoded), max_tokens)]
+        pieces.extend(slices[:-1])
+        current = slices[-1]
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_sections(sections, max_tokens, model='gpt-4'):
+    # Greedily packs consecutive sections (e.g. one per daily note) into
+    # chunks of at most max_tokens, keeping each section whole if it fits
+    chunks = []
+    current = []
+    current_tokens = 0
+    for section in sections:
+        section_tokens = count_tokens(section, model)
+        if section_tokens > max_tokens:
+            if current:
+                chunks.append(''.join(current))
+                current, current_tokens = [], 0
+            chunks.extend(split_text(section, max_tokens, model))
+            continue
+        if current and current_tokens + section_tokens > max_tokens:
+            chunks.append(''.join(current))
+            current, current_tokens = [], 0
+        current.append(section)
+        current_tokens += section_tokens
+    if current:
+        chunks.append(''.join(current))
+    return chunks
@@ -0,0 +1,373 @@
+import collections
+import os
+import re
+import sqlite3
+import sys
+import threading
+from datetime import date
+
+import locks
+from lazy_imports import lazy_import
+from search import SUMMARY_FIELDS, WORD_PATTERN
+from storage import get_store
+
+np = lazy_import('numpy')
+
+INDEX_DIRNAME = os.path.join('.lifeos', 'trends')
+DATABASE_FILENAME = 'trends.db'
+SOURCES = ('summary', 'notes')
+# Phrases are counted up to this many words (single words and word pairs)
+MAX_PHRASE_WORDS = 2
+GRANULARITIES = ('week', 'month', 'year')
+# Weeks and query bounds: zero-padded YYYY-MM-DD, the only form week_day takes
+DATE_PATTERN = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}')
+
+SCHEMA = """
+-- The phrases each write added, joined by newlines: term ids first_id,
+-- first_id + 1, ... in order. Ids are never reused.
+CREATE TABLE IF NOT EXISTS vocab (
+    first_id INTEGER PRIMARY KEY,
+    phrases TEXT NOT NULL
+);
+-- One row per week and source: its word count, and the term ids and counts
+-- of its phrases as little-endian int32 arrays. seq is the write that last
+-- replaced the row.
+CREATE TABLE IF NOT EXISTS weeks (
+    week TEXT NOT NULL,
+    source TEXT NOT NULL,
+    words INTEGER NOT NULL,
+    terms BLOB NOT NULL,
+    counts BLOB NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (week, source)
+);
+CREATE INDEX IF NOT EXISTS weeks_seq ON weeks (seq);
+-- A single row: the last write's seq, and a generation bumped by every rebuild
+CREATE TABLE IF NOT EXISTS state (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    generation INTEGER NOT NULL,
+    seq INTEGER NOT NULL
+);
+"""
+
+# resolved directory -> TrendsIndex
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def phrase_counts(texts):
+    # Occurrences of every word and word pair in texts, and the number of words
+    counts = collections.Counter()
+    total = 0
+    for text in texts:
+        words = WORD_PATTERN.findall(text.lower())
+        total += len(words)
+        counts.update(words)
+        counts.update(f'{first} {second}' for first, second in zip(words, words[1:]))
+    return counts, total
+
+
+def normalize_phrase(phrase):
+    # A query phrase spelled the way phrase_counts counts it
+    words = WORD_PATTERN.findall(phrase.lower())
+    if not words:
+        raise ValueError(f'{phrase!r} has no words to count')
+    if len(words) > MAX_PHRASE_WORDS:
+        raise ValueError(f'{phrase!r} is longer than {MAX_PHRASE_WORDS} words')
+    return ' '.join(words)
+
+
+def is_date(value):
+    if not DATE_PATTERN.fullmatch(value):
+        return False
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def week_day(week):
+    # Week keys (the Monday, YYYY-MM-DD) as days since the epoch
+    return np.datetime64(week, 'D').astype(np.int64)
+
+
+class TrendsIndex:
+    # Phrase counts for every summarized week, kept in .lifeos/trends/trends.db
+    # (SQLite, WAL mode) as one row per week and source. Committing a week
+    # replaces only that week's rows and appends any new phrases to the
+    # vocabulary, and every write gets the next sequence number, so a reader
+    # that has loaded before fetches just the weeks written since. In memory the
+    # counts are one sparse row per week and source in compressed sparse row
+    # form: rows of term ids and counts laid end to end, with indptr marking
+    # where each week's row starts. Queries read a per-term inverted index
+    # (the transpose) built from it on first use, so a rollup only touches
+    # the weeks that mention a phrase.
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_dir = os.path.join(directory, INDEX_DIRNAME)
+        self.path = os.path.join(self.index_dir, DATABASE_FILENAME)
+        self.lock = threading.RLock()
+        self.file_lock = locks.get_lock(directory, 'trends')
+        self._db = None
+        self._reset()
+
+    def _reset(self):
+        self.weeks = np.zeros(0, dtype=np.int64)
+        self.vocab = []
+        self.term_ids = {}
+        # source -> (indptr, term ids, counts, words per week)
+        self.rows = {source: (np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32),
+                              np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)) for source in SOURCES}
+        # source -> (term indptr, week rows, counts), built on first query
+        self.postings = {}
+        # The rebuild generation and last write these arrays reflect
+        self.generation = None
+        self.seq = 0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(self.index_dir, exist_ok=True)
+            self._db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def _state(self):
+        rows = self._connect().execute('SELECT generation, seq FROM state').fetchall()
+        return rows[0] if rows else (0, 0)
+
+    def load(self):
+        # Fetches the weeks written since the last load, or everything after a rebuild
+        with self.lock, self.file_lock.read():
+            if not self.exists():
+                return
+            generation, seq = self._state()
+            if generation != self.generation:
+                self._reset()
+            elif seq == self.seq:
+                return
+            db = self._connect()
+            for (phrases,) in db.execute('SELECT phrases FROM vocab WHERE first_id >= ? ORDER BY first_id',
+                                         (len(self.vocab),)):
+                for phrase in phrases.split('\n'):
+                    self.term_ids[phrase] = len(self.vocab)
+                    self.vocab.append(phrase)
+            weeks = {}
+            for week, source, words, terms, counts in db.execute(
+                    'SELECT week, source, words, terms, counts FROM weeks WHERE seq > ?', (self.seq,)):
+                weeks.setdefault(week, {})[source] = (np.frombuffer(terms, dtype='<i4'),
+                                                      np.frombuffer(counts, dtype='<i4'), words)
+            self._merge(weeks)
+            self.generation, self.seq = generation, seq
+
+    def replace_weeks(self, weeks, rebuild=False):
+        # weeks: week -> source -> (Counter of phrases, word count), replacing
+        # whatever was counted for those weeks before (or everything, with rebuild)
+        if not weeks and not rebuild:
+            return
+        with self.lock, self.file_lock.write():
+            try:
+                self._replace_weeks(weeks, rebuild)
+            except BaseException:
+                # Reload everything next time rather than trust half-updated arrays
+                self.generation = None
+                raise
+
+    def _replace_weeks(self, weeks, rebuild):
+        if rebuild:
+            self._reset()
+        else:
+            self.load()
+        first_new_term = len(self.vocab)
+        rows = {}
+        for week, week_sources in weeks.items():
+            week_day(week)
+            rows[week] = {}
+            for source in SOURCES:
+                phrases, word_count = week_sources.get(source, ({}, 0))
+                rows[week][source] = (np.array([self._term_id(phrase) for phrase in phrases], dtype='<i4'),
+                                      np.array(list(phrases.values()), dtype='<i4'), word_count)
+        generation, seq = self._state()
+        generation, seq = generation + (1 if rebuild else 0), seq + 1
+        cursor = self._connect().cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            if rebuild:
+                cursor.execute('DELETE FROM vocab')
+                cursor.execute('DELETE FROM weeks')
+            if len(self.vocab) > first_new_term:
+                cursor.execute('INSERT INTO vocab (first_id, phrases) VALUES (?, ?)',
+                               (first_new_term, '\n'.join(self.vocab[first_new_term:])))
+            cursor.executemany(
+                'INSERT OR REPLACE INTO weeks (week, source, words, terms, counts, seq) VALUES (?, ?, ?, ?, ?, ?)',
+                [(week, source, word_count, ids.tobytes(), counts.tobytes(), seq)
+                 for week, week_rows in rows.items() for source, (ids, counts, word_count) in week_rows.items()])
+            cursor.execute('INSERT OR REPLACE INTO state (id, generation, seq) VALUES (0, ?, ?)', (generation, seq))
+            cursor.execute('COMMIT')
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        self._merge(rows)
+        self.generation, self.seq = generation, seq
+
+    def _merge(self, weeks):
+        # Puts weeks (week -> source -> (term ids, counts, word count)) in the
+        # arrays in place of whatever they held for those weeks
+        new_weeks = np.array([week_day(week) for week in weeks], dtype=np.int64)
+        keep = ~np.isin(self.weeks, new_weeks)
+        all_weeks = np.concatenate((self.weeks[keep], new_weeks))
+        order = np.argsort(all_weeks, kind='stable')
+        for source in SOURCES:
+            indptr, terms, counts, words = self.rows[source]
+            lengths = np.diff(indptr)
+            kept = np.repeat(keep, lengths)
+            new_terms, new_counts, new_lengths, new_words = [terms[kept]], [counts[kept]], [], []
+            for week_sources in weeks.values():
+                ids, week_counts, word_count = week_sources[source]
+                new_terms.append(ids)
+                new_counts.append(week_counts)
+                new_lengths.append(len(ids))
+                new_words.append(word_count)
+            # Rows for the kept weeks then the new ones, reordered by week
+            lengths = np.concatenate((lengths[keep], np.array(new_lengths, dtype=np.int64)))
+            terms = np.concatenate(new_terms).astype(np.int32)
+            counts = np.concatenate(new_counts).astype(np.int32)
+            words = np.concatenate((words[keep], np.array(new_words, dtype=np.int64)))
+            starts = np.concatenate(([0], np.cumsum(lengths)))[:-1]
+            indptr = np.concatenate(([0], np.cumsum(lengths[order]))).astype(np.int64)
+            take = np.repeat(starts[order] - indptr[:-1], lengths[order]) + np.arange(indptr[-1])
+            self.rows[source] = (indptr, terms[take], counts[take], words[order])
+        self.weeks = all_weeks[order]
+        self.postings = {}
+
+    def _term_id(self, phrase):
+        term_id = self.term_ids.get(phrase)
+        if term_id is None:
+            term_id = self.term_ids[phrase] = len(self.vocab)
+            self.vocab.append(phrase)
+        return term_id
+
+    def _postings(self, source):
+        # The inverted index: for each term, the week rows it appears in and its counts there
+        postings = self.postings.get(source)
+        if postings is None:
+            indptr, terms, counts, _ = self.rows[source]
+            order = np.argsort(terms, kind='stable')
+            week_rows = np.repeat(np.arange(len(self.weeks)), np.diff(indptr))[order]
+            term_indptr = np.concatenate(([0], np.cumsum(np.bincount(terms, minlength=len(self.vocab)))))
+            postings = self.postings[source] = (term_indptr, week_rows, counts[order])
+        return postings
+
+    def week_counts(self, phrase, sources):
+        # Occurrences of a normalized phrase in each week, summed over sources
+        counts = np.zeros(len(self.weeks), dtype=np.int64)
+        term_id = self.term_ids.get(phrase)
+        if term_id is None:
+            return counts
+        for source in sources:
+            term_indptr, week_rows, term_counts = self._postings(source)
+            start, end = term_indptr[term_id], term_indptr[term_id + 1]
+            # A term appears at most once per week row, so the rows are unique
+            counts[week_rows[start:end]] += term_counts[start:end]
+        return counts
+
+    def trends(self, phrases, start=None, end=None, granularity='month', sources=SOURCES):
+        # Counts of each phrase rolled up by week, month or year between the
+        # weeks starting on `start` and `end` (YYYY-MM-DD, inclusive). Weeks
+        # belong to the month and year their Monday falls in. Periods with no
+        # summarized weeks are included with zeros, so series line up.
+        normalized = [normalize_phrase(phrase) for phrase in phrases]
+        with self.lock:
+            self.load()
+            weeks = self.weeks
+            in_range = np.ones(len(weeks), dtype=bool)
+            if start:
+                in_range &= weeks >= week_day(start)
+            if end:
+                in_range &= weeks <= week_day(end)
+            if not in_range.any():
+                return {'periods': [], 'words': [], 'weeks': [], 'series': {
+                    phrase: {'counts': [], 'weeks': [], 'per_1000_words': []} for phrase in phrases}}
+            days = weeks[in_range].astype('datetime64[D]')
+            if granularity == 'week':
+                first, last = days.min(), days.max()
+                period_of_week = ((days - first) // np.timedelta64(7, 'D')).astype(np.int64)
+                labels = np.arange(first, last + np.timedelta64(1, 'D'), np.timedelta64(7, 'D'))
+            else:
+                unit = 'M' if granularity == 'month' else 'Y'
+                periods = days.astype(f'datetime64[{unit}]')
+                first, last = periods.min(), periods.max()
+                period_of_week = (periods - first).astype(np.int64)
+                labels = np.arange(first, last + np.timedelta64(1, unit))
+            length = len(labels)
+            week_words = sum(self.rows[source][3] for source in sources)[in_range]
+            words = np.bincount(period_of_week, weights=week_words, minlength=length)
+            result = {
+                'periods': [str(label) for label in labels],
+                'words': words.astype(np.int64).tolist(),
+                'weeks': np.bincount(period_of_week, minlength=length).tolist(),
+                'series': {},
+            }
+            for phrase, term in zip(phrases, normalized):
+                counts = self.week_counts(term, sources)[in_range]
+                totals = np.bincount(period_of_week, weights=counts, minlength=length)
+                result['series'][phrase] = {
+                    'counts': totals.astype(np.int64).tolist(),
+                    # Weeks in each period that mention the phrase at all
+                    'weeks': np.bincount(period_of_week, weights=counts > 0, minlength=length).astype(np.int64).tolist(),
+                    'per_1000_words': np.round(totals * 1000 / np.maximum(words, 1), 3).tolist(),
+                }
+            return result
+
+
+def get_index(directory):
+    directory = os.path.realpath(os.path.expanduser(directory))
+    with _indexes_lock:
+        index = _indexes.get(directory)
+        if index is None:
+            index = _indexes[directory] = TrendsIndex(directory)
+    return index
+
+
+def week_phrase_counts(entry, notes):
+    # source -> (phrase counts, word count) for one week. notes maps filename -> text.
+    summary = entry.get('summary', {})
+    fields = [summary[field] for field in SUMMARY_FIELDS if isinstance(summary.get(field), str)]
+    return {'summary': phrase_counts(fields), 'notes': phrase_counts(notes.values())}
+
+
+def index_week(directory, entry, notes):
+    get_index(directory).replace_weeks({entry['week']: week_phrase_counts(entry, notes)})
+
+
+def build_index(directory):
+    # Full (re)build from the stored summaries and the notes on disk, written once at the end
+    store = get_store(directory)
+    weeks = {}
+    for entry in store.load_summaries():
+        try:
+            week_day(entry['week'])
+        except ValueError:
+            print(f'Skipping week {entry["week"]}: not a YYYY-MM-DD week')
+            continue
+        notes = {}
+        for filename in entry.get('files', []):
+            try:
+                with open(os.path.join(store.directory, filename), 'r', encoding='utf-8') as f:
+                    notes[filename] = f.read()
+            except (FileNotFoundError, UnicodeDecodeError):
+                continue
+        weeks[entry['week']] = week_phrase_counts(entry, notes)
+        print(f'Counted week {entry["week"]}')
+    index = get_index(directory)
+    index.replace_weeks(weeks, rebuild=True)
+    return index
+
+
+if __name__ == "__main__":
+    build_index(sys.argv[1] if len(sys.argv) > 1 else '~/notes')
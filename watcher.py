@@ -0,0 +1,202 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+
+import manifest
+from response_cache import cache as response_cache
+from storage import ADVICE_FILENAME, get_store
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct('iIII')
+
+# resolved directory -> NoteWatcher
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def _libc():
+    return ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+
+def _inotify_fd(directory):
+    # Returns (an inotify fd watching `directory`, its watch descriptor), or
+    # (None, None) where inotify isn't available
+    if not sys.platform.startswith('linux'):
+        return None, None
+    try:
+        libc = _libc()
+        fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+    except (OSError, AttributeError):
+        return None, None
+    if fd < 0:
+        return None, None
+    wd = libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK)
+    if wd < 0:
+        os.close(fd)
+        return None, None
+    _watch_subdirectories(fd, directory)
+    return fd, wd
+
+
+def _watch_subdirectories(fd, directory):
+    # inotify isn't recursive: watch every non-hidden subdirectory that notes
+    # can live in. Re-adding an existing watch is a no-op.
+    libc = _libc()
+    for root, dirs, _ in os.walk(directory):
+        dirs[:] = [name for name in dirs if not name.startswith('.')]
+        for name in dirs:
+            libc.inotify_add_watch(fd, os.fsencode(os.path.join(root, name)), WATCH_MASK)
+
+
+class NoteWatcher:
+    # Keeps a directory's unsummarized weeks and counts in memory, and the
+    # serialized summaries warm in the response cache, refreshing them only
+    # when the directory changes so the endpoints the UI polls stay O(1).
+    def __init__(self, directory, poll_interval=2.0):
+        self.directory = directory
+        self.store = get_store(directory)
+        self.poll_interval = poll_interval
+        self.unsummarized_weeks = {}
+        self.unsummarized_count = 0
+        self.mode = None
+        self._stop = threading.Event()
+        # Set when a refresh failed, so the next quiet moment retries it
+        self._stale = False
+        self._thread = None
+        self._root_wd = None
+
+    def start(self):
+        self.refresh_notes()
+        self.refresh_summaries()
+        fd, self._root_wd = _inotify_fd(self.directory)
+        self.mode = 'inotify' if fd is not None else 'polling'
+        target = self._run_inotify if fd is not None else self._run_polling
+        self._thread = threading.Thread(target=target, args=(fd,) if fd is not None else (),
+                                        name=f'watcher:{self.directory}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def refresh_notes(self):
+        # get_dirty_weeks reads the manifest under the store lock; the result is ours alone
+        unsummarized_weeks = manifest.get_dirty_weeks(self.directory)
+        # Swap in whole objects so readers never see a half-built index
+        self.unsummarized_weeks = unsummarized_weeks
+        self.unsummarized_count = sum(len(files) for files in unsummarized_weeks.values())
+
+    def _try_refresh_notes(self):
+        # A failed refresh (a lock timeout while another worker hashes the
+        # directory, say) mustn't kill the watcher thread; it's retried later.
+        # Only the directory itself going away stops the watcher.
+        try:
+            self.refresh_notes()
+            self._stale = False
+        except FileNotFoundError:
+            self._stop.set()
+        except Exception as e:
+            print(f'Error refreshing notes in {self.directory}: {str(e)}')
+            self._stale = True
+
+    def refresh_summaries(self):
+        try:
+            response_cache.get_document(self.store, 'summaries')
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            # Caught mid-write by an external, non-atomic writer; the close event will follow
+            pass
+        except Exception as e:
+            # The endpoint loads it on demand instead
+            print(f'Error caching summaries in {self.directory}: {str(e)}')
+
+    def _run_inotify(self, fd):
+        try:
+            while not self._stop.is_set():
+                ready, _, _ = select.select([fd], [], [], 1.0)
+                if not ready:
+                    if self._stale:
+                        self._try_refresh_notes()
+                    continue
+                names = set()
+                try:
+                    while True:
+                        names.update(self._read_events(fd))
+                except BlockingIOError:
+                    pass
+                self._handle(names)
+        finally:
+            os.close(fd)
+            # However the thread ends, watch() then starts a fresh watcher
+            self._stop.set()
+
+    def _read_events(self, fd):
+        data = os.read(fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+            offset += length
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF) and wd == self._root_wd:
+                self._stop.set()
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and not name.startswith('.'):
+                _watch_subdirectories(fd, self.directory)
+            yield name
+
+    def _handle(self, names):
+        # Hidden names are temp files from atomic writes and the .lifeos index directory
+        names = {name for name in names if not name.startswith('.')}
+        names.discard(ADVICE_FILENAME)
+        if names & self.store.summaries_watch_names:
+            self.refresh_summaries()
+        if names:
+            self._try_refresh_notes()
+
+    def _run_polling(self):
+        try:
+            self._poll()
+        finally:
+            self._stop.set()
+
+    def _poll(self):
+        summaries_signature = None
+        while not self._stop.wait(self.poll_interval):
+            try:
+                signature = self.store.signature('summaries')
+            except FileNotFoundError:
+                signature = None
+            except Exception as e:
+                print(f'Error checking summaries in {self.directory}: {str(e)}')
+                signature = summaries_signature
+            if signature != summaries_signature:
+                summaries_signature = signature
+                self.refresh_summaries()
+            self._try_refresh_notes()
+
+
+def watch(directory):
+    # Returns the running watcher for `directory`, starting one on first use
+    directory = os.path.realpath(os.path.expanduser(directory))
+    with _watchers_lock:
+        note_watcher = _watchers.get(directory)
+        if note_watcher is None or note_watcher._stop.is_set():
+            note_watcher = _watchers[directory] = NoteWatcher(directory).start()
+        return note_watcher